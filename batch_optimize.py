@@ -0,0 +1,228 @@
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import csv
+import itertools
+import json
+import os
+import sys
+import time
+
+import course_optimizer as co
+import result_cache
+
+# Columns of the CSV input. There's one row per course, and the rows of a student have to be next to each other.
+# Categories are separated by semicolons, grade is empty for pass/fail courses.
+CSV_COLUMNS = ('student', 'name', 'grade', 'credits', 'categories', 'lab', 'passfail')
+# How many students can be in flight per worker. Results go out in input order, so this also bounds how many finished
+# results can pile up behind a slow one.
+PENDING_PER_WORKER = 4
+# Options the command line and optimize_server give each engine. In input order, the incremental search can take
+# minutes on a 30-course transcript that it solves in well under a second in heuristic order, so it gets that, even
+# though ties may then go to a different assignment than with a plain optimize().
+ENGINE_OPTIONS = {'incremental': {'heuristic_order': True}}
+
+
+def course_from_dict(data):
+    # {"name": ..., "grade": ..., "credits": ..., "categories": ["CORE_FOCUS", ...], "lab": false, "passfail": false}
+    if not isinstance(data.get('categories'), list):
+        raise ValueError('Course ' + str(data.get('name')) + ' needs a list of categories')
+    try:
+        categories = [co.Category[category] for category in data['categories']]
+    except KeyError as e:
+        raise ValueError('Unknown category or missing field: ' + str(e))
+    passfail = bool(data.get('passfail', False))
+    grade = data.get('grade')
+    if grade is None and not passfail:
+        raise ValueError('Course ' + str(data.get('name')) + ' needs a grade unless it is pass/fail')
+    course = co.Course(data.get('name', ''), float(grade) if grade is not None else None, float(data['credits']),
+                       *categories)
+    return course.lab(bool(data.get('lab', False))).passfail(passfail)
+
+
+def course_to_dict(course):
+    return {'name': str(course), 'grade': course.grade, 'credits': course.credits,
+            'categories': [category.name for category in course.categories], 'lab': course._is_lab,
+            'passfail': course._is_passfail}
+
+
+def result_to_dict(result):
+    data = {'possible': result.possible, 'max_grade': result.max_grade, 'optimal': result.optimal}
+    if result.possible:
+        data['assignments'] = {category.name: [str(course) for course in assigned]
+                               for category, assigned in result.assignments.items() if assigned}
+    return data
+
+
+def read_jsonl(lines):
+    # One {"student": ..., "courses": [...]} object per line. A line that isn't such an object doesn't stop the others:
+    # its error takes the place of the courses, so that it gets reported in input order like any other bad record.
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield line_number, ValueError('Line ' + str(line_number) + ' is not valid JSON: ' + str(e))
+            continue
+        if not isinstance(record, dict) or not isinstance(record.get('courses'), list):
+            student = record.get('student', line_number) if isinstance(record, dict) else line_number
+            yield student, ValueError('Line ' + str(line_number) + ' has no list of courses')
+            continue
+        yield record.get('student', line_number), record['courses']
+
+
+def _csv_flag(value):
+    return value.strip().lower() in ('1', 'true', 'yes', 'y')
+
+
+def read_csv(lines):
+    # Like read_jsonl, a student with a bad row gets the error instead of the courses.
+    rows = csv.DictReader(lines)
+    if rows.fieldnames is None or not set(CSV_COLUMNS) <= set(rows.fieldnames):
+        raise ValueError('CSV input needs the columns ' + ', '.join(CSV_COLUMNS))
+    for student, student_rows in itertools.groupby(rows, key=lambda row: row['student']):
+        courses = []
+        for row in student_rows:
+            # DictReader fills in None for the missing fields of a short row, and puts the extra ones of a long row
+            # under None
+            if None in row or None in row.values():
+                courses = ValueError('Student ' + str(student) + ' has a row without exactly the columns ' +
+                                     ', '.join(rows.fieldnames))
+                break
+            courses.append({
+                'name': row['name'],
+                'grade': row['grade'] if row['grade'].strip() else None,
+                'credits': row['credits'],
+                'categories': [category.strip() for category in row['categories'].split(';') if category.strip()],
+                'lab': _csv_flag(row['lab']),
+                'passfail': _csv_flag(row['passfail']),
+            })
+        yield student, courses
+
+
+# the ResultCache of each cache file, and the RuleSet of each rules file, this process has used
+_caches = {}
+_rule_sets = {}
+
+
+def _optimize_record(record, engine, options, cache_path=None, rules_path=None):
+    # a bad record gives {"student": ..., "error": ...} instead of a result, so the rest of the cohort still gets
+    # optimized
+    try:
+        return _optimize_courses(record, engine, options, cache_path, rules_path)
+    except (ValueError, KeyError, TypeError) as e:
+        return {'student': record[0], 'error': str(e)}
+
+
+def _optimize_courses(record, engine, options, cache_path, rules_path):
+    student, course_dicts = record
+    if isinstance(course_dicts, Exception):
+        raise course_dicts
+    courses = [course_from_dict(data) for data in course_dicts]
+    if rules_path is not None:
+        # loaded once per process, so every student shares the rule set's compiled tables
+        rules = _rule_sets.get(rules_path)
+        if rules is None:
+            rules = _rule_sets[rules_path] = co.load_rules(rules_path)
+        options = dict(options, rules=rules)
+    start = time.perf_counter()
+    if cache_path is None:
+        result = co.optimize(courses, engine=engine, **options)
+    else:
+        cache = _caches.get(cache_path)
+        if cache is None:
+            cache = _caches[cache_path] = result_cache.ResultCache(cache_path)
+        hits = cache.hits
+        lookup_seconds = cache.lookup_seconds
+        result = cache.optimize(courses, engine=engine, **options)
+    seconds = time.perf_counter() - start
+    data = {'student': student}
+    data.update(result_to_dict(result))
+    data['seconds'] = seconds
+    if cache_path is not None:
+        data['cached'] = cache.hits > hits
+        data['lookup_seconds'] = cache.lookup_seconds - lookup_seconds
+    return data
+
+
+def optimize_stream(records, workers=1, engine='incremental', cache_path=None, rules_path=None, **options):
+    # Optimizes (student, course dicts) records and yields the result dicts in input order. Only a few records per
+    # worker are read ahead, so the input doesn't have to fit into memory. With cache_path, results go through a
+    # result_cache.ResultCache in that file. With rules_path, the rules come from that file (see co.load_rules).
+    if workers == 1:
+        for record in records:
+            yield _optimize_record(record, engine, options, cache_path, rules_path)
+        return
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for record in records:
+            pending.append(executor.submit(_optimize_record, record, engine, options, cache_path, rules_path))
+            if len(pending) >= workers * PENDING_PER_WORKER:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Optimize the course assignments of many students at once.')
+    parser.add_argument('input', help='JSON lines or CSV file with the transcripts, - for stdin')
+    parser.add_argument('-o', '--output', default='-', help='where to write the JSON lines results (default: stdout)')
+    parser.add_argument('--format', choices=('jsonl', 'csv'), help='input format (default: from the file extension)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--engine', default='incremental', choices=sorted(co.ENGINES))
+    parser.add_argument('--time-limit', type=float, help='seconds per student, for the incremental engine')
+    parser.add_argument('--cache', help='SQLite file to cache results in')
+    parser.add_argument('--rules', help='JSON file with the degree rules (default: the built-in ones)')
+    args = parser.parse_args(argv)
+
+    input_format = args.format or ('csv' if args.input.endswith('.csv') else 'jsonl')
+    options = dict(ENGINE_OPTIONS.get(args.engine, {}))
+    if args.time_limit is not None:
+        options['time_limit'] = args.time_limit
+    input_file = sys.stdin if args.input == '-' else open(args.input, newline='')
+    output_file = sys.stdout if args.output == '-' else open(args.output, 'w')
+    latencies = []
+    errors = 0
+    cache_hits = 0
+    lookup_seconds = 0.
+    start = time.perf_counter()
+    try:
+        records = read_csv(input_file) if input_format == 'csv' else read_jsonl(input_file)
+        for data in optimize_stream(records, args.workers, args.engine, args.cache, args.rules, **options):
+            output_file.write(json.dumps(data) + '\n')
+            if 'error' in data:
+                errors += 1
+                continue
+            latencies.append(data['seconds'])
+            if args.cache is not None:
+                cache_hits += data['cached']
+                lookup_seconds += data['lookup_seconds']
+    finally:
+        if input_file is not sys.stdin:
+            input_file.close()
+        if output_file is not sys.stdout:
+            output_file.close()
+    seconds = time.perf_counter() - start
+
+    latencies.sort()
+    print('Optimized', len(latencies), 'students in', format(seconds, '.2f'), 'seconds (' +
+          format(len(latencies) / seconds if seconds > 0. else 0., '.1f') + ' students/second).', file=sys.stderr)
+    print('Latency per student: mean', format(sum(latencies) / len(latencies) if latencies else 0., '.4f'),
+          's, p50', format(percentile(latencies, 0.5), '.4f'), 's, p99', format(percentile(latencies, 0.99), '.4f'),
+          's, max', format(latencies[-1] if latencies else 0., '.4f'), 's.', file=sys.stderr)
+    if errors:
+        print(errors, 'students could not be optimized, see the "error" field of their results.', file=sys.stderr)
+    if args.cache is not None and latencies:
+        print('Cache hit rate', format(cache_hits / len(latencies), '.1%') + ', mean lookup latency',
+              format(lookup_seconds / len(latencies), '.6f'), 's.', file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+import argparse
+import json
+import multiprocessing
+import platform
+import random
+import statistics
+import time
+import tracemalloc
+
+import course_optimizer as co
+import optimize
+import result_cache
+
+# category lists the synthetic courses pick from, roughly how courses are labeled in practice
+CATEGORY_CHOICES = [
+    [co.Category.CORE_FOCUS, co.Category.ELECTIVE_CS, co.Category.ELECTIVE],
+    [co.Category.ELECTIVE_FOCUS, co.Category.ELECTIVE_CS, co.Category.ELECTIVE],
+    [co.Category.SEMINAR_IN_FOCUS],
+    [co.Category.ELECTIVE_CS, co.Category.ELECTIVE],
+    [co.Category.INTERFOCUS],
+    [co.Category.ELECTIVE],
+    [co.Category.SCIENCE_IN_PERSPECTIVE],
+]
+
+
+def random_transcript(seed, num_courses):
+    # a thesis, a seminar, a GESS course and an interfocus lab, and random courses for the rest
+    rng = random.Random(seed)
+    courses = [
+        co.Course("Thesis", rng.choice([4.5, 5.0, 5.5]), 30, co.Category.THESIS),
+        co.Course("Seminar", rng.choice([4.5, 5.0, 5.5]), 2, co.Category.SEMINAR_IN_FOCUS),
+        co.Course("GESS", rng.choice([4.5, 5.0, 5.5]), 2, co.Category.SCIENCE_IN_PERSPECTIVE),
+        co.Course("Interfocus lab", rng.choice([4.5, 5.0, 5.5]), 12, co.Category.INTERFOCUS),
+    ]
+    while len(courses) < num_courses:
+        courses.append(_random_course(rng, "Course " + str(len(courses))))
+    rng.shuffle(courses)
+    return courses[:num_courses]
+
+
+def _random_course(rng, name, lab_fraction=0.2, passfail_fraction=0.1):
+    course = co.Course(name, rng.choice([3.5, 4.0, 4.25, 4.75, 5.0, 5.5, 6.0]), rng.choice([2, 4, 5, 6, 8, 10]),
+                       *rng.choice(CATEGORY_CHOICES))
+    course.lab(rng.random() < lab_fraction)
+    if rng.random() < passfail_fraction:
+        course.passfail(True)
+    return course
+
+
+# (name, credits, categories) of courses that meet every minimum on their own, with exactly 90 credits
+FEASIBLE_BACKBONE = [
+    ("Thesis", 30, [co.Category.THESIS]),
+    ("Seminar", 2, [co.Category.SEMINAR_IN_FOCUS]),
+    ("GESS", 2, [co.Category.SCIENCE_IN_PERSPECTIVE]),
+    ("Interfocus lab", 12, [co.Category.INTERFOCUS]),
+    ("Core focus I", 8, [co.Category.CORE_FOCUS, co.Category.ELECTIVE_CS, co.Category.ELECTIVE]),
+    ("Core focus II", 6, [co.Category.CORE_FOCUS, co.Category.ELECTIVE_CS, co.Category.ELECTIVE]),
+    ("Elective focus I", 6, [co.Category.ELECTIVE_FOCUS, co.Category.ELECTIVE_CS, co.Category.ELECTIVE]),
+    ("Elective focus II", 8, [co.Category.ELECTIVE_FOCUS, co.Category.ELECTIVE_CS, co.Category.ELECTIVE]),
+    ("Elective CS", 8, [co.Category.ELECTIVE_CS, co.Category.ELECTIVE]),
+    ("Elective", 8, [co.Category.ELECTIVE]),
+]
+
+
+def synthetic_transcript(seed, num_courses, feasible=True, lab_fraction=0.2, passfail_fraction=0.1):
+    # Unlike random_transcript, whether the transcript is feasible is known up front: feasible ones contain
+    # FEASIBLE_BACKBONE (with random grades), infeasible ones the same without the thesis. The rest are random courses
+    # with lab_fraction labs and passfail_fraction pass/fail courses.
+    if num_courses < len(FEASIBLE_BACKBONE):
+        raise ValueError('Synthetic transcripts need at least ' + str(len(FEASIBLE_BACKBONE)) + ' courses')
+    rng = random.Random(seed)
+    courses = [co.Course(name, rng.choice([4.0, 4.5, 5.0, 5.5, 6.0]), credits, *categories)
+               for name, credits, categories in FEASIBLE_BACKBONE[0 if feasible else 1:]]
+    while len(courses) < num_courses:
+        courses.append(_random_course(rng, "Course " + str(len(courses)), lab_fraction, passfail_fraction))
+    rng.shuffle(courses)
+    return courses
+
+
+def count_nodes(courses, **options):
+    stats = co.SearchStats()
+    start = time.perf_counter()
+    co.optimize(courses, stats=stats, **options)
+    return stats.nodes, time.perf_counter() - start
+
+
+def ordering_benchmark(sizes=(15, 20, 25), seeds=10):
+    # search nodes and seconds with and without order_courses, per transcript size
+    transcripts = [('sample', [optimize.sample_courses()])]
+    transcripts += [(str(size) + ' courses', [random_transcript(seed, size) for seed in range(seeds)])
+                    for size in sizes]
+    rows = []
+    for name, course_lists in transcripts:
+        row = {'transcripts': name}
+        for label, heuristic_order in (('input_order', False), ('heuristic_order', True)):
+            nodes = 0
+            seconds = 0.
+            for courses in course_lists:
+                list_nodes, list_seconds = count_nodes(courses, heuristic_order=heuristic_order)
+                nodes += list_nodes
+                seconds += list_seconds
+            row[label] = {'nodes': nodes, 'seconds': seconds}
+        rows.append(row)
+    return rows
+
+
+# (label, engine, options) of everything the engine benchmark runs
+ENGINE_CONFIGURATIONS = [(engine, engine, {}) for engine in sorted(co.ENGINES)] + [
+    ('incremental-heuristic', 'incremental', {'heuristic_order': True}),
+]
+DEFAULT_SIZES = tuple(range(10, 61, 10))
+# per case; an engine that takes longer than this isn't run on bigger transcripts any more
+DEFAULT_MAX_SECONDS = 10.
+# tracemalloc slows things down, so the memory run gets more time
+MEMORY_TIME_FACTOR = 5.
+
+
+def _run_case(connection, courses, engine, options, measure_memory):
+    # Runs in a child process, so a case that takes too long can just be killed. Sends the timing run's numbers, then
+    # the peak memory of a second run under tracemalloc. The parallel engine's workers aren't traced.
+    try:
+        # so that importing numpy or scipy for the engine isn't timed
+        co.optimize([], engine=engine)
+        stats = co.SearchStats() if engine == 'incremental' else None
+        start = time.perf_counter()
+        result = co.optimize(courses, engine=engine, **dict(options, stats=stats) if stats else options)
+        connection.send({'status': 'ok', 'seconds': time.perf_counter() - start, 'possible': result.possible,
+                         'max_grade': result.max_grade, 'nodes': stats.nodes if stats else None})
+        if measure_memory:
+            tracemalloc.start()
+            co.optimize(courses, engine=engine, **options)
+            connection.send(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+    except Exception as e:
+        connection.send({'status': 'error', 'error': type(e).__name__ + ': ' + str(e)})
+    finally:
+        connection.close()
+
+
+def measure(courses, engine, options=None, max_seconds=DEFAULT_MAX_SECONDS, measure_memory=True):
+    # wall time, search nodes (incremental engine only) and peak memory of optimizing courses with engine
+    row = {'status': 'timeout', 'seconds': None, 'possible': None, 'max_grade': None, 'nodes': None,
+           'peak_bytes': None}
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=_run_case, args=(sender, courses, engine, options or {}, measure_memory))
+    process.start()
+    sender.close()
+    try:
+        if receiver.poll(max_seconds):
+            row.update(receiver.recv())
+            if row['status'] == 'ok' and measure_memory and receiver.poll(max_seconds * MEMORY_TIME_FACTOR):
+                row['peak_bytes'] = receiver.recv()
+    except EOFError:
+        row['status'] = 'error'
+        row['error'] = 'process died'
+    finally:
+        if process.is_alive():
+            process.terminate()
+        process.join()
+        receiver.close()
+    return row
+
+
+def engine_benchmark(sizes=DEFAULT_SIZES, seeds=3, configurations=None, max_seconds=DEFAULT_MAX_SECONDS,
+                     measure_memory=True, progress=None):
+    # Runs every configuration on a feasible and an infeasible synthetic transcript per seed and size. Once a
+    # configuration times out, its remaining cases are skipped. Returns the per-case rows; progress is called with
+    # each one.
+    configurations = ENGINE_CONFIGURATIONS if configurations is None else configurations
+    timed_out = set()
+    rows = []
+    for size in sizes:
+        for seed in range(seeds):
+            for feasible in (True, False):
+                courses = synthetic_transcript(seed, size, feasible)
+                for label, engine, options in configurations:
+                    row = {'engine': label, 'courses': size, 'seed': seed, 'feasible': feasible}
+                    if label in timed_out:
+                        row['status'] = 'skipped'
+                    else:
+                        row.update(measure(courses, engine, options, max_seconds, measure_memory))
+                        if row['status'] == 'timeout':
+                            timed_out.add(label)
+                    rows.append(row)
+                    if progress is not None:
+                        progress(row)
+    return rows
+
+
+def summarize(rows):
+    # per configuration and size: median and max seconds, median nodes and max peak memory of the finished cases
+    groups = {}
+    for row in rows:
+        groups.setdefault((row['engine'], row['courses']), []).append(row)
+    summary = []
+    for (engine, size), group in sorted(groups.items()):
+        finished = [row for row in group if row['status'] == 'ok']
+        seconds = [row['seconds'] for row in finished]
+        nodes = [row['nodes'] for row in finished if row['nodes'] is not None]
+        peaks = [row['peak_bytes'] for row in finished if row['peak_bytes'] is not None]
+        summary.append({
+            'engine': engine, 'courses': size, 'cases': len(group), 'finished': len(finished),
+            'median_seconds': statistics.median(seconds) if seconds else None,
+            'max_seconds': max(seconds) if seconds else None,
+            'median_nodes': statistics.median(nodes) if nodes else None,
+            'max_peak_bytes': max(peaks) if peaks else None,
+        })
+    return summary
+
+
+def disagreements(rows):
+    # cases where the engines that finished don't agree on the best grade
+    results = {}
+    for row in rows:
+        if row['status'] == 'ok':
+            results.setdefault((row['courses'], row['seed'], row['feasible']), []).append(row)
+    mismatches = []
+    for (size, seed, feasible), case_rows in sorted(results.items()):
+        reference = case_rows[0]
+        for row in case_rows[1:]:
+            if row['possible'] != reference['possible'] or (
+                    row['possible'] and abs(row['max_grade'] - reference['max_grade']) > 1e-6):
+                mismatches.append({'courses': size, 'seed': seed, 'feasible': feasible,
+                                   'engines': [reference['engine'], row['engine']],
+                                   'max_grades': [reference['max_grade'], row['max_grade']]})
+    return mismatches
+
+
+def benchmark_report(rows, max_seconds=DEFAULT_MAX_SECONDS):
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'rules_version': result_cache.rules_version(),
+        'max_seconds': max_seconds,
+        'summary': summarize(rows),
+        'disagreements': disagreements(rows),
+        'cases': rows,
+    }
+
+
+def compare_reports(old, new, threshold=1.25):
+    # summary entries whose median time grew by more than threshold between two reports, or that stopped finishing
+    old_summary = {(entry['engine'], entry['courses']): entry for entry in old['summary']}
+    regressions = []
+    for entry in new['summary']:
+        old_entry = old_summary.get((entry['engine'], entry['courses']))
+        if old_entry is None or old_entry['median_seconds'] is None:
+            continue
+        if entry['median_seconds'] is None or entry['finished'] < old_entry['finished']:
+            regressions.append({'engine': entry['engine'], 'courses': entry['courses'], 'old': old_entry['finished'],
+                                'new': entry['finished'], 'what': 'finished cases'})
+        elif entry['median_seconds'] > threshold * max(old_entry['median_seconds'], 1e-3):
+            regressions.append({'engine': entry['engine'], 'courses': entry['courses'],
+                                'old': old_entry['median_seconds'], 'new': entry['median_seconds'],
+                                'what': 'median seconds'})
+    return regressions
+
+
+def _print_ordering_benchmark():
+    print('Search nodes (and seconds), summed over the transcripts of each size:')
+    for row in ordering_benchmark():
+        print('\t', row['transcripts'] + ':',
+              'input order', row['input_order']['nodes'], '(' + format(row['input_order']['seconds'], '.2f') + ')',
+              'heuristic order', row['heuristic_order']['nodes'],
+              '(' + format(row['heuristic_order']['seconds'], '.2f') + ')')
+
+
+def _print_case(row):
+    if row['status'] == 'ok':
+        details = format(row['seconds'], '.3f') + 's'
+        if row['nodes'] is not None:
+            details += ', ' + str(row['nodes']) + ' nodes'
+        if row['peak_bytes'] is not None:
+            details += ', ' + format(row['peak_bytes'] / 1e6, '.1f') + ' MB'
+    else:
+        details = row['status'] + (': ' + row['error'] if 'error' in row else '')
+    print('\t', row['engine'], row['courses'], 'courses, seed', row['seed'],
+          'feasible' if row['feasible'] else 'infeasible', '-', details, flush=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the optimization engines on synthetic transcripts.')
+    parser.add_argument('-o', '--output', default='benchmark.json', help='where to write the JSON results')
+    parser.add_argument('--engines', nargs='+', choices=[label for label, _, _ in ENGINE_CONFIGURATIONS])
+    parser.add_argument('--sizes', nargs='+', type=int, default=DEFAULT_SIZES)
+    parser.add_argument('--seeds', type=int, default=3)
+    parser.add_argument('--max-seconds', type=float, default=DEFAULT_MAX_SECONDS)
+    parser.add_argument('--no-memory', action='store_true', help='skip the peak memory runs')
+    parser.add_argument('--compare', help='earlier JSON results to check for regressions')
+    parser.add_argument('--ordering', action='store_true',
+                        help='only compare node counts with and without heuristic ordering')
+    args = parser.parse_args(argv)
+
+    if args.ordering:
+        _print_ordering_benchmark()
+        return
+    configurations = [configuration for configuration in ENGINE_CONFIGURATIONS
+                      if args.engines is None or configuration[0] in args.engines]
+    rows = engine_benchmark(args.sizes, args.seeds, configurations, args.max_seconds, not args.no_memory, _print_case)
+    report = benchmark_report(rows, args.max_seconds)
+    with open(args.output, 'w') as output_file:
+        json.dump(report, output_file, indent=2)
+    print('Wrote', len(rows), 'cases to', args.output)
+    for mismatch in report['disagreements']:
+        print('Engines disagree:', mismatch)
+    if args.compare:
+        with open(args.compare) as compare_file:
+            regressions = compare_reports(json.load(compare_file), report)
+        for regression in regressions:
+            print('Regression:', regression['engine'], regression['courses'], 'courses,', regression['what'],
+                  regression['old'], '->', regression['new'])
+        if not regressions:
+            print('No regressions compared to', args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,14 @@
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from enum import Enum, unique
+import heapq
+import json
+import math
+import multiprocessing
+import numbers
+import operator
+import os
+import time
 
 
 @unique
@@ -23,75 +33,102 @@ INTERFOCUS_CREDITS_REQUIRED = 12
 GESS_CREDITS_REQUIRED = 2
 THESIS_CREDITS_REQUIRED = 30
 
+# The rules of the default regulations, in the format load_rules() reads (see RuleSet). Credits assigned to a category
+# go to each of its counters, and every counter has to reach its minimum (or go above it, if it's strict).
+DEFAULT_RULES_CONFIG = {
+    'name': 'default',
+    'counters': [
+        {'name': 'total', 'min_credits': TOTAL_CREDITS_REQUIRED},
+        {'name': 'focus_and_elective', 'min_credits': FOCUS_AND_ELECTIVE_CREDITS_REQUIRED},
+        {'name': 'focus', 'min_credits': FOCUS_CREDITS_REQUIRED},
+        {'name': 'core_focus', 'min_credits': CORE_FOCUS_CREDITS_REQUIRED, 'strict': True},
+        {'name': 'seminar_in_focus', 'min_credits': SEMINAR_IN_FOCUS_CREDITS_REQUIRED},
+        {'name': 'elective_cs', 'min_credits': ELECTIVE_CS_CREDITS_REQUIRED},
+        {'name': 'interfocus', 'min_credits': INTERFOCUS_CREDITS_REQUIRED},
+        {'name': 'gess', 'min_credits': GESS_CREDITS_REQUIRED},
+        {'name': 'thesis', 'min_credits': THESIS_CREDITS_REQUIRED},
+    ],
+    'categories': {
+        'CORE_FOCUS': ['total', 'focus_and_elective', 'focus', 'core_focus'],
+        'ELECTIVE_FOCUS': ['total', 'focus_and_elective', 'focus'],
+        'SEMINAR_IN_FOCUS': ['total', 'focus_and_elective', 'focus', 'seminar_in_focus'],
+        'ELECTIVE_CS': ['total', 'focus_and_elective', 'elective_cs'],
+        'INTERFOCUS': ['total', 'interfocus'],
+        'ELECTIVE': ['total'],
+        'SCIENCE_IN_PERSPECTIVE': ['total', 'gess'],
+        'THESIS': ['total', 'thesis'],
+    },
+    # The final grade is a weighted average of these per-group averages. Everything else only counts for credits.
+    'grade_groups': [
+        {'categories': ['CORE_FOCUS', 'ELECTIVE_FOCUS', 'SEMINAR_IN_FOCUS'], 'weight': 3.},
+        {'categories': ['INTERFOCUS'], 'weight': 1.},
+        {'categories': ['ELECTIVE_CS'], 'weight': 1.},
+        {'categories': ['THESIS'], 'weight': 2.},
+    ],
+}
+
+# positions of the default rules' counters in CreditCounts.values(); all_greater_than_or_equal wants strictly more
+# than the minimum for core focus
+(TOTAL_COUNTER, FOCUS_AND_ELECTIVE_COUNTER, FOCUS_COUNTER, CORE_FOCUS_COUNTER, SEMINAR_IN_FOCUS_COUNTER,
+ ELECTIVE_CS_COUNTER, INTERFOCUS_COUNTER, GESS_COUNTER, THESIS_COUNTER) = range(9)
+
 
 class CreditCounts:
+    # The keyword arguments and all_greater_than_or_equal are for the default rules' counters, other rule sets create
+    # their counts with from_values and check them with RuleSet.satisfied.
+    __slots__ = ('_counts',)
+
     def __init__(self, total=0, focus_and_elective=0, focus=0, core_focus=0, seminar_in_focus=0, elective_cs=0,
                  interfocus=0, gess=0, thesis=0):
-        self._total = total
-        self._focus_and_elective = focus_and_elective
-        self._focus = focus
-        self._core_focus = core_focus
-        self._seminar_in_focus = seminar_in_focus
-        self._elective_cs = elective_cs
-        self._interfocus = interfocus
-        self._gess = gess
-        self._thesis = thesis
+        self._counts = [total, focus_and_elective, focus, core_focus, seminar_in_focus, elective_cs, interfocus, gess,
+                        thesis]
+
+    @staticmethod
+    def from_values(values):
+        counts = CreditCounts.__new__(CreditCounts)
+        counts._counts = list(values)
+        return counts
 
     def add_assigned_course(self, category_assigned, credits):
-        self._total += credits
-        # PYTHON Y U NO SWITCH-CASE
-        if category_assigned == Category.CORE_FOCUS:
-            self._core_focus += credits
-            self._focus += credits
-            self._focus_and_elective += credits
-        elif category_assigned == Category.ELECTIVE_FOCUS:
-            self._focus += credits
-            self._focus_and_elective += credits
-        elif category_assigned == Category.SEMINAR_IN_FOCUS:
-            self._seminar_in_focus += credits
-            self._focus += credits
-            self._focus_and_elective += credits
-        elif category_assigned == Category.ELECTIVE_CS:
-            self._elective_cs += credits
-            self._focus_and_elective += credits
-        elif category_assigned == Category.INTERFOCUS:
-            self._interfocus += credits
-        elif category_assigned == Category.ELECTIVE:
-            pass
-        elif category_assigned == Category.SCIENCE_IN_PERSPECTIVE:
-            self._gess += credits
-        elif category_assigned == Category.THESIS:
-            self._thesis += credits
+        self.add_credits(CATEGORY_COUNTERS[category_assigned], credits)
 
-    def all_greater_than_or_equal(self, other):
-        result = self._total >= other._total \
-                 and self._focus_and_elective >= other._focus_and_elective \
-                 and self._focus >= other._focus \
-                 and self._core_focus > other._core_focus \
-                 and self._seminar_in_focus >= other._seminar_in_focus \
-                 and self._elective_cs >= other._elective_cs \
-                 and self._interfocus >= other._interfocus \
-                 and self._gess >= other._gess \
-                 and self._thesis >= other._thesis
-        return result
+    def remove_assigned_course(self, category_assigned, credits):
+        self.add_credits(CATEGORY_COUNTERS[category_assigned], -credits)
 
-    def __str__(self):
-        return 'counts: [' + str(self._total) + ', ' + str(self._focus_and_elective) + ', ' + str(
-            self._focus) + ', ' + str(self._core_focus) + ', ' + str(self._seminar_in_focus) + ', ' + str(
-            self._elective_cs) + ', ' + str(self._interfocus) + ', ' + str(self._gess) + ', ' + str(self._thesis) + ']'
+    def add_credits(self, counters, credits):
+        counts = self._counts
+        for counter in counters:
+            counts[counter] += credits
 
+    def copy(self):
+        counts = CreditCounts.__new__(CreditCounts)
+        counts._counts = self._counts.copy()
+        return counts
 
-MIN_CREDIT_COUNTS = CreditCounts(total=90, focus_and_elective=36, focus=26, core_focus=10, seminar_in_focus=2,
-                                 elective_cs=8, interfocus=12, gess=2, thesis=30)
+    def __add__(self, other):
+        counts = CreditCounts.__new__(CreditCounts)
+        counts._counts = [value + other_value for value, other_value in zip(self._counts, other._counts)]
+        return counts
 
+    def all_greater_than_or_equal(self, other):
+        counts = self._counts
+        other_counts = other._counts
+        result = counts[TOTAL_COUNTER] >= other_counts[TOTAL_COUNTER] \
+                 and counts[FOCUS_AND_ELECTIVE_COUNTER] >= other_counts[FOCUS_AND_ELECTIVE_COUNTER] \
+                 and counts[FOCUS_COUNTER] >= other_counts[FOCUS_COUNTER] \
+                 and counts[CORE_FOCUS_COUNTER] > other_counts[CORE_FOCUS_COUNTER] \
+                 and counts[SEMINAR_IN_FOCUS_COUNTER] >= other_counts[SEMINAR_IN_FOCUS_COUNTER] \
+                 and counts[ELECTIVE_CS_COUNTER] >= other_counts[ELECTIVE_CS_COUNTER] \
+                 and counts[INTERFOCUS_COUNTER] >= other_counts[INTERFOCUS_COUNTER] \
+                 and counts[GESS_COUNTER] >= other_counts[GESS_COUNTER] \
+                 and counts[THESIS_COUNTER] >= other_counts[THESIS_COUNTER]
+        return result
 
-def create_credit_counts_from_assignments(assignments):
-    counts = CreditCounts()
+    def values(self):
+        return tuple(self._counts)
 
-    for category, assigned in assignments.items():
-        for course in assigned:
-            counts.add_assigned_course(category, course.credits)
-    return counts
+    def __str__(self):
+        return 'counts: [' + ', '.join(str(value) for value in self._counts) + ']'
 
 
 def compute_weighted_avg_by_credits(courses):
@@ -109,15 +146,190 @@ def compute_weighted_avg_by_credits(courses):
     return total_grade / total_credits
 
 
-def compute_grade(assignments):
-    focus_avg = compute_weighted_avg_by_credits(
-        assignments[Category.CORE_FOCUS] + assignments[Category.ELECTIVE_FOCUS] + assignments[
-            Category.SEMINAR_IN_FOCUS])
-    interfocus_avg = compute_weighted_avg_by_credits(assignments[Category.INTERFOCUS])
-    elective_cs_avg = compute_weighted_avg_by_credits(assignments[Category.ELECTIVE_CS])
-    thesis_avg = compute_weighted_avg_by_credits(assignments[Category.THESIS])
+def _parse_category(name):
+    try:
+        return Category[name]
+    except KeyError:
+        raise ValueError('Unknown category: ' + str(name))
+
+
+def _requirement_bounds(min_counts, strict):
+    # What every count has to be at least, so the search can check all counters with one map over operator.ge, which
+    # runs in C and is faster than a loop. A strict minimum becomes the next float above it, since for floats
+    # count > min_credits is the same as count >= nextafter(min_credits, inf).
+    return tuple(math.nextafter(float(min_credits), math.inf) if is_strict else float(min_credits)
+                 for min_credits, is_strict in zip(min_counts, strict))
+
+
+def _requirements_check(bounds):
+    # a function that takes the list of counts, which the search calls at every node
+    return lambda counts: all(map(operator.ge, counts, bounds))
+
+
+def _parse_min_credits(counter):
+    min_credits = counter['min_credits']
+    # no strings like '10', and no inf or nan, which no amount of credits could (or would always) satisfy
+    if isinstance(min_credits, bool) or not isinstance(min_credits, numbers.Real) or not math.isfinite(min_credits):
+        raise ValueError('Counter ' + str(counter['name']) + ' needs a finite number of min_credits, not ' +
+                         repr(min_credits))
+    return min_credits
+
+
+class RuleSet:
+    # Degree rules compiled from a config like DEFAULT_RULES_CONFIG into the tables the engines use: the counters each
+    # category's credits go to (counter indices in category_counters, and the same as a category x counter 0/1
+    # incidence matrix in incidence), the minimum credits of every counter, and the grade groups with their weights.
+    # Rule sets are immutable, so courses compiled for one (see compile_courses) can share its per-category tables.
+    def __init__(self, config):
+        self.config = config
+        self.name = str(config.get('name', ''))
+        try:
+            counters = config['counters']
+            categories = config['categories']
+            grade_groups = config['grade_groups']
+        except KeyError as e:
+            raise ValueError('Rules need ' + str(e))
+        self.counter_names = tuple(str(counter['name']) for counter in counters)
+        if len(set(self.counter_names)) != len(self.counter_names):
+            raise ValueError('Duplicate counter names in rules ' + self.name)
+        self.num_counters = len(self.counter_names)
+        self.min_counts = tuple(_parse_min_credits(counter) for counter in counters)
+        self.strict = tuple(bool(counter.get('strict', False)) for counter in counters)
+        self.min_credit_counts = CreditCounts.from_values(self.min_counts)
+
+        positions = {name: counter for counter, name in enumerate(self.counter_names)}
+        # categories the rules don't mention don't count for anything
+        self.category_counters = {category: () for category in Category}
+        for name, counter_names in categories.items():
+            try:
+                self.category_counters[_parse_category(name)] = tuple(sorted({positions[counter_name]
+                                                                              for counter_name in counter_names}))
+            except KeyError as e:
+                raise ValueError('Unknown counter ' + str(e) + ' for category ' + name)
+        self.incidence = {category: tuple(1 if counter in category_counters else 0
+                                          for counter in range(self.num_counters))
+                          for category, category_counters in self.category_counters.items()}
+
+        self.grade_groups = tuple((tuple(_parse_category(name) for name in group['categories']), float(group['weight']))
+                                  for group in grade_groups)
+        self.weights = tuple(weight for _, weight in self.grade_groups)
+        self.weight_total = sum(self.weights)
+        if any(weight < 0. for weight in self.weights) or self.weight_total <= 0.:
+            raise ValueError('Grade group weights have to be non-negative, and not all zero')
+        self.category_groups = {category: None for category in Category}
+        for group, (group_categories, _) in enumerate(self.grade_groups):
+            for category in group_categories:
+                if self.category_groups[category] is not None:
+                    raise ValueError('Category ' + category.name + ' is in more than one grade group')
+                self.category_groups[category] = group
+        # A group has to get at least the minimum of every counter that only its categories feed. That's what the
+        # grade bounds assume it still needs.
+        self.group_min_credits = tuple(
+            max([min_credits for counter, min_credits in enumerate(self.min_counts)
+                 if self._counter_categories(counter) and self._counter_categories(counter) <= set(group_categories)],
+                default=0)
+            for group_categories, _ in self.grade_groups)
+
+        self._bounds = _requirement_bounds(self.min_counts, self.strict)
+        self._is_satisfied = _requirements_check(self._bounds)
+        # (categories, is lab) -> options, undominated options, groups and optimistic counters, see compile_options
+        self._compiled_options = {}
+
+    def __reduce__(self):
+        # the compiled check can't be pickled, so compile it again on the other side
+        return RuleSet, (self.config,)
+
+    def _counter_categories(self, counter):
+        return {category for category, counters in self.category_counters.items() if counter in counters}
+
+    def as_dict(self):
+        # the config in a canonical form, for saving or hashing
+        return {
+            'name': self.name,
+            'counters': [dict({'name': name, 'min_credits': min_credits}, **({'strict': True} if is_strict else {}))
+                         for name, min_credits, is_strict in zip(self.counter_names, self.min_counts, self.strict)],
+            'categories': {category.name: [self.counter_names[counter] for counter in counters]
+                           for category, counters in self.category_counters.items() if counters},
+            'grade_groups': [{'categories': [category.name for category in categories], 'weight': weight}
+                             for categories, weight in self.grade_groups],
+        }
+
+    def empty_counts(self):
+        return CreditCounts.from_values((0,) * self.num_counters)
 
-    return (3. * focus_avg + interfocus_avg + elective_cs_avg + 2. * thesis_avg) / (3. + 1. + 1. + 2.)
+    def satisfied(self, counts):
+        return self._is_satisfied(counts._counts)
+
+    def credit_counts(self, assignments):
+        counts = self.empty_counts()
+        for category, assigned in assignments.items():
+            for course in assigned:
+                counts.add_credits(self.category_counters[category], course.credits)
+        return counts
+
+    def capped_values(self, counts):
+        # Once a counter has reached its minimum, more credits there can't make a difference anymore, so two partial
+        # assignments whose capped values agree can be completed in exactly the same ways.
+        capped = []
+        for value, min_value, is_strict in zip(counts.values(), self.min_counts, self.strict):
+            if is_strict:
+                capped.append(value if value <= min_value else float('inf'))
+            else:
+                capped.append(min(value, min_value))
+        return tuple(capped)
+
+    def grade_from_group_sums(self, group_credits, group_points):
+        # same as grade, but from the graded credits and credits * grade sums of each group
+        total = 0.
+        for weight, credits, points in zip(self.weights, group_credits, group_points):
+            total += weight * (points / credits if credits != 0. else 0.)
+        return total / self.weight_total
+
+    def grade(self, assignments):
+        total = 0.
+        for categories, weight in self.grade_groups:
+            group_courses = []
+            for category in categories:
+                group_courses += assignments[category]
+            total += weight * compute_weighted_avg_by_credits(group_courses)
+        return total / self.weight_total
+
+    def compile_options(self, categories, is_lab):
+        # What CompiledCourse needs for a course with these (deduplicated) categories. Only depends on the categories
+        # and the lab flag, so it's computed once per rule set and shared by every course and transcript.
+        key = (categories, is_lab)
+        compiled = self._compiled_options.get(key)
+        if compiled is None:
+            # (category, counters it feeds, grade group) for each category
+            options = tuple((category, self.category_counters[category], self.category_groups[category])
+                            for category in categories)
+            compiled = self._compiled_options[key] = (
+                options, tuple(_undominated_options(categories, is_lab, self)),
+                frozenset(self.category_groups[category] for category in categories) - {None},
+                optimistic_counters(categories, self))
+        return compiled
+
+
+def load_rules(path):
+    # a rule set from a JSON file in the format of DEFAULT_RULES_CONFIG
+    with open(path) as rules_file:
+        return RuleSet(json.load(rules_file))
+
+
+DEFAULT_RULES = RuleSet(DEFAULT_RULES_CONFIG)
+# The default rules' tables, for code that doesn't deal with rule sets
+CATEGORY_COUNTERS = DEFAULT_RULES.category_counters
+MIN_CREDIT_COUNTS = DEFAULT_RULES.min_credit_counts
+# Grades closer than this are considered a tie, so float noise can't make the search prefer one over the other
+GRADE_TOLERANCE = 1e-9
+
+
+def create_credit_counts_from_assignments(assignments, rules=None):
+    return (rules or DEFAULT_RULES).credit_counts(assignments)
+
+
+def compute_grade(assignments, rules=None):
+    return (rules or DEFAULT_RULES).grade(assignments)
 
 
 class Course:
@@ -154,90 +366,102 @@ class Course:
 
 
 class OptimizationResult:
-    def __init__(self, possible, max_grade, assignments, worst_grade):
+    def __init__(self, possible, max_grade, assignments, worst_grade, pruned_nodes=0, memo_hits=0, memo_misses=0):
         self.possible = possible
         self.max_grade = max_grade
         self.assignments = assignments
         # Just for kicks:
         self.worst_grade = worst_grade
+        # number of subtrees the branch-and-bound search cut because they couldn't beat the best grade found so far
+        self.pruned_nodes = pruned_nodes
+        # lookups in the memo table of the memoized search, if it was used
+        self.memo_hits = memo_hits
+        self.memo_misses = memo_misses
+        # how much faster than optimize_incremental the parallel search was, if it was asked to measure that
+        self.speedup = None
+        # SearchStats of the search, if it was asked to collect them
+        self.stats = None
+        # False if the search ran out of time or nodes before it could rule out anything better
+        self.optimal = True
+        # the best few assignments as results of their own, best first, if the search was asked for the top k
+        self.top_results = None
 
 
-def optimize(courses):
-    result = optimize_dfs(courses)
+def optimize(courses, engine='incremental', rules=None, **options):
+    # rules is a RuleSet, the default rules if not given
+    if engine not in ENGINES:
+        raise ValueError('Unknown optimization engine: ' + str(engine))
+    # the engines all work on compiled courses, so convert them once here
+    result = ENGINES[engine](compile_courses(courses, rules), **options)
     return result
 
 
+def optimize_rule_sets(courses, rule_sets, engine='incremental', **options):
+    # The best result under each of the rule sets. The courses' categories are only deduplicated once, and each rule
+    # set's per-category tables are shared with every other transcript compiled for it.
+    courses = compile_courses(courses)
+    return [optimize(compile_courses(courses, rules), engine, **options) for rules in rule_sets]
+
+
 def copy_assignments(assignments):
     return {category: course_list.copy() for category, course_list in assignments.items()}
 
-def possibly_satisfiable(remaining_courses, current_assignments):
-    partial_counts = create_credit_counts_from_assignments(current_assignments)
+def optimistic_counters(categories, rules=None):
+    # Pretend the course is assigned to every valid category at once. A single assignment can't give a counter more than
+    # the course's credits, so each counter that any of the categories feeds gets them once.
+    category_counters = (rules or DEFAULT_RULES).category_counters
+    counters = set()
+    for category in categories:
+        counters.update(category_counters[category])
+    return tuple(sorted(counters))
+
+
+def add_optimistic_credits(partial_counts, course, rules=None):
+    partial_counts.add_credits(optimistic_counters(course.categories, rules), course.credits)
+
+
+def possibly_satisfiable(remaining_courses, current_assignments, rules=None):
+    rules = rules or DEFAULT_RULES
+    partial_counts = rules.credit_counts(current_assignments)
     # try assigning the course to every valid category
     for course in remaining_courses:
-        partial_counts._total += course.credits
-        any_focus = False
-        any_focus_and_elective = False
-        for category in course.categories:
-            if category == Category.CORE_FOCUS:
-                partial_counts._core_focus += course.credits
-                any_focus = True
-                any_focus_and_elective = True
-            elif category == Category.ELECTIVE_FOCUS:
-                any_focus = True
-                any_focus_and_elective = True
-            elif category == Category.SEMINAR_IN_FOCUS:
-                partial_counts._seminar_in_focus += course.credits
-                any_focus = True
-                any_focus_and_elective = True
-            elif category == Category.ELECTIVE_CS:
-                partial_counts._elective_cs += course.credits
-                partial_counts._focus_and_elective += course.credits
-            elif category == Category.INTERFOCUS:
-                partial_counts._interfocus += course.credits
-            elif category == Category.ELECTIVE:
-                pass
-            elif category == Category.SCIENCE_IN_PERSPECTIVE:
-                partial_counts._gess += course.credits
-            elif category == Category.THESIS:
-                partial_counts._thesis += course.credits
-        if any_focus:
-            partial_counts._focus += course.credits
-        if any_focus_and_elective:
-            partial_counts._focus_and_elective += course.credits
-    return partial_counts.all_greater_than_or_equal(MIN_CREDIT_COUNTS)
-
-
-def optimize_dfs(courses, assignments={category: [] for category in Category}, has_lab=False):
+        add_optimistic_credits(partial_counts, course, rules)
+    return rules.satisfied(partial_counts)
+
+
+def optimize_dfs(courses, assignments=None, has_lab=False, rules=None):
+    rules = rules or DEFAULT_RULES
+    if assignments is None:
+        assignments = {category: [] for category in Category}
     if len(courses) == 0:
-        counts = create_credit_counts_from_assignments(assignments)
-        if counts.all_greater_than_or_equal(MIN_CREDIT_COUNTS):
-            grade = compute_grade(assignments)
+        counts = rules.credit_counts(assignments)
+        if rules.satisfied(counts):
+            grade = rules.grade(assignments)
             return OptimizationResult(True, grade, copy_assignments(assignments), grade)
         else:
             return OptimizationResult(False, None, None, None)
 
     # Check if it's still possible to satisfy the requirements in the best case
     # We could probably compute this incrementally, but I don't think it's a bottleneck yet.
-    if not possibly_satisfiable(courses, assignments):
+    if not possibly_satisfiable(courses, assignments, rules):
         return OptimizationResult(False, None, None, None)
 
-    counts = create_credit_counts_from_assignments(assignments)
+    counts = rules.credit_counts(assignments)
     # might already be viable
-    if counts.all_greater_than_or_equal(MIN_CREDIT_COUNTS):
-        grade = compute_grade(assignments)
+    if rules.satisfied(counts):
+        grade = rules.grade(assignments)
         best_result = OptimizationResult(True, grade, copy_assignments(assignments), grade)
     else:
         best_result = None
 
     cur_course = courses[0]
     remaining_courses = courses[1:]
-    next_has_lab = has_lab or cur_course._is_lab
     # can't assign more than one lab
     if not cur_course._is_lab or not has_lab:
         # just try all the options
         for category in cur_course.categories:
             assignments[category].append(cur_course)
-            cur_result = optimize_dfs(remaining_courses, assignments, next_has_lab)
+            cur_result = optimize_dfs(remaining_courses, assignments, has_lab or cur_course._is_lab, rules)
             if best_result is None or not best_result.possible:
                 best_result = cur_result
             elif cur_result.possible and cur_result.max_grade > best_result.max_grade:
@@ -245,8 +469,8 @@ def optimize_dfs(courses, assignments={category: [] for category in Category}, h
                 best_result = cur_result
             assignments[category].pop()
 
-    # also consider not listing this course at all
-    cur_result = optimize_dfs(remaining_courses, assignments, next_has_lab)
+    # also consider not listing this course at all (an unlisted lab doesn't use up the lab slot)
+    cur_result = optimize_dfs(remaining_courses, assignments, has_lab, rules)
     if best_result is None or not best_result.possible:
         best_result = cur_result
     elif cur_result.possible and cur_result.max_grade > best_result.max_grade:
@@ -254,3 +478,1093 @@ def optimize_dfs(courses, assignments={category: [] for category in Category}, h
         best_result = cur_result
 
     return best_result
+
+
+class CompiledCourse:
+    # What the engines work with instead of Course: categories without duplicates (in the order they were listed, so
+    # ties still go the same way), and everything the search looks up per course and category precomputed. See
+    # compile_courses.
+    __slots__ = ('course', 'index', 'grade', 'credits', '_is_lab', '_is_passfail', 'categories', 'category_mask',
+                 'options', 'undominated', 'groups', 'optimistic_counters')
+
+    def __init__(self, course, index, categories=None, rules=None):
+        self.course = course
+        self.index = index
+        self.grade = course.grade
+        self.credits = course.credits
+        self._is_lab = course._is_lab
+        self._is_passfail = course._is_passfail
+        self.category_mask = 0
+        unique_categories = []
+        # categories can be tried in a different order than the course lists them in, see order_courses
+        for category in categories or course.categories:
+            if not self.category_mask & 1 << category.value:
+                self.category_mask |= 1 << category.value
+                unique_categories.append(category)
+        self.categories = tuple(unique_categories)
+        self.options, self.undominated, self.groups, self.optimistic_counters = (
+            rules or DEFAULT_RULES).compile_options(self.categories, self._is_lab)
+
+    def option(self, category):
+        return self.options[self.categories.index(category)]
+
+    def __str__(self):
+        return str(self.course)
+
+
+class CompiledCourses(list):
+    # the compiled courses, and the rule set they were compiled for
+    def __init__(self, courses, rules):
+        super().__init__(courses)
+        self.rules = rules
+
+
+def compile_courses(courses, rules=None):
+    # Done once in optimize(), the engines call it again in case they're used directly. Courses compiled for another
+    # rule set are compiled again, keeping their category order.
+    if isinstance(courses, CompiledCourses) and (rules is None or rules is courses.rules):
+        return courses
+    rules = rules or DEFAULT_RULES
+    return CompiledCourses([CompiledCourse(course.course, index, course.categories, rules)
+                            if isinstance(course, CompiledCourse) else CompiledCourse(course, index, rules=rules)
+                            for index, course in enumerate(courses)], rules)
+
+
+def order_courses(courses):
+    # Search order for optimize(..., heuristic_order=True). Courses that could go into several grade groups are the
+    # choices that matter most for the grade, so they come first, then the ones with more categories and more credits,
+    # which settle the credit requirements early so that infeasible branches get cut sooner. Labs come after otherwise
+    # similar courses. Each course's categories are tried in order of estimated grade contribution: how far the grade
+    # is above the average of everything that could go into the group, times the group's weight.
+    courses = compile_courses(courses)
+    rules = courses.rules
+    group_credits = [0.] * len(rules.grade_groups)
+    group_points = [0.] * len(rules.grade_groups)
+    for course in courses:
+        if not course._is_passfail:
+            for group in course.groups:
+                group_credits[group] += course.credits
+                group_points[group] += course.credits * course.grade
+    group_averages = [points / credits if credits != 0. else 0. for credits, points in zip(group_credits, group_points)]
+
+    def contribution(course, category):
+        group = rules.category_groups[category]
+        if group is None or course._is_passfail:
+            return 0.
+        return rules.weights[group] * (course.grade - group_averages[group])
+
+    ordered = sorted(courses, key=lambda course: (-len(course.groups), -len(course.categories), -course.credits,
+                                                  course._is_lab))
+    return CompiledCourses([CompiledCourse(course.course, index, sorted(
+        course.categories, key=lambda category: -contribution(course, category)), rules)
+        for index, course in enumerate(ordered)], rules)
+
+
+def _restore_order(result, positions):
+    # puts the courses in each category back in the order they were given in, after searching in a different order
+    for ordered_result in [result] + (result.top_results or []):
+        if ordered_result.assignments is not None:
+            for assigned in ordered_result.assignments.values():
+                assigned.sort(key=lambda course: positions[id(course)])
+    return result
+
+
+def original_assignments(assignments):
+    return {category: [course.course for course in assigned] for category, assigned in assignments.items()}
+
+
+def optimistic_suffix_counts(courses):
+    # optimistic credits (see optimistic_counters) of every suffix of the compiled course list
+    suffix_counts = [courses.rules.empty_counts()]
+    for course in reversed(courses):
+        counts = suffix_counts[-1].copy()
+        counts.add_credits(course.optimistic_counters, course.credits)
+        suffix_counts.append(counts)
+    suffix_counts.reverse()
+    return suffix_counts
+
+
+def suffix_grade_ranges(courses):
+    # for every suffix of the compiled course list, the (lowest, highest) grade its graded courses could still add to
+    # each group, or (None, None) if they can't add anything
+    ranges = [tuple((None, None) for _ in courses.rules.grade_groups)]
+    for course in reversed(courses):
+        suffix_ranges = list(ranges[-1])
+        if not course._is_passfail:
+            for group in course.groups:
+                min_grade, max_grade = suffix_ranges[group]
+                suffix_ranges[group] = (course.grade if min_grade is None else min(min_grade, course.grade),
+                                        course.grade if max_grade is None else max(max_grade, course.grade))
+        ranges.append(tuple(suffix_ranges))
+    ranges.reverse()
+    return ranges
+
+
+def _optimize_dfs(courses):
+    # optimize_dfs is the reference the other engines are checked against, so it sticks to the Course objects
+    courses = compile_courses(courses)
+    return optimize_dfs([course.course for course in courses], rules=courses.rules)
+
+
+def group_candidates(courses):
+    # for each grade group, the graded courses that could be assigned to it as (grade, credits, index, is lab), best
+    # grade first
+    candidates = [[] for _ in courses.rules.grade_groups]
+    for course in courses:
+        if not course._is_passfail:
+            for group in course.groups:
+                candidates[group].append((course.grade, course.credits, course.index, course._is_lab))
+    for group_courses in candidates:
+        group_courses.sort(key=lambda candidate: (-candidate[0], candidate[2]))
+    return candidates
+
+
+def optimistic_group_average(credits, points, missing, candidates, index, has_lab):
+    # Highest average a group can get by adding candidates from index onwards, when it still needs at least `missing`
+    # graded credits. This is the LP relaxation: take courses best-first while they're needed for the minimum or beat
+    # the running average, and only the needed fraction of a course that would pull the average down.
+    for grade, course_credits, course_index, is_lab in candidates:
+        if course_index < index or (is_lab and has_lab):
+            continue
+        if credits != 0. and grade * credits <= points:
+            if missing <= 0.:
+                break
+            course_credits = min(course_credits, missing)
+        credits += course_credits
+        points += course_credits * grade
+        missing -= course_credits
+    return points / credits if credits != 0. else 0.
+
+
+class SearchState:
+    # Partial assignment for the incremental search. Credit counts and per-group grade sums are updated on push/pop,
+    # and the optimistic credits of every suffix of the course list are precomputed, so all the checks we need at a
+    # node are O(1) instead of rebuilding everything from the assignments.
+    def __init__(self, courses):
+        self.courses = compile_courses(courses)
+        self.rules = rules = self.courses.rules
+        self._is_satisfied = rules._is_satisfied
+        self._bounds = rules._bounds
+        self.counts = rules.empty_counts()
+        self.has_lab = False
+        num_groups = len(rules.grade_groups)
+        self.group_credits = [0.] * num_groups
+        self.group_points = [0.] * num_groups
+        self.group_passfail_credits = [0.] * num_groups
+        # Restoring the old values on pop (rather than subtracting) keeps the float sums exact. What pop needs is
+        # kept in lists with a slot for every depth, so push doesn't allocate anything.
+        size = len(self.courses)
+        self._depth = 0
+        self._undo_courses = [None] * size
+        self._undo_options = [None] * size
+        self._undo_has_lab = [False] * size
+        # the group's old credits (or pass/fail credits for a pass/fail course) and points
+        self._undo_credits = [0.] * size
+        self._undo_points = [0.] * size
+        self._optimistic_suffix = optimistic_suffix_counts(self.courses)
+        self._group_candidates = group_candidates(self.courses)
+        # how many pass/fail credits each suffix of the course list could still put into each group
+        self._passfail_suffix = [[0.] * num_groups]
+        for course in reversed(self.courses):
+            passfail_credits = self._passfail_suffix[-1].copy()
+            if course._is_passfail:
+                for group in course.groups:
+                    passfail_credits[group] += course.credits
+            self._passfail_suffix.append(passfail_credits)
+        self._passfail_suffix.reverse()
+
+    @property
+    def assignments(self):
+        # the current assignment, with the original Course objects
+        assignments = {category: [] for category in Category}
+        for depth in range(self._depth):
+            assignments[self._undo_options[depth][0]].append(self._undo_courses[depth].course)
+        return assignments
+
+    def push(self, course, option):
+        # option is one of course.options; each course can only be pushed once at a time
+        _, counters, group = option
+        depth = self._depth
+        self._undo_courses[depth] = course
+        self._undo_options[depth] = option
+        self._undo_has_lab[depth] = self.has_lab
+        if group is not None:
+            if course._is_passfail:
+                self._undo_credits[depth] = self.group_passfail_credits[group]
+                self.group_passfail_credits[group] += course.credits
+            else:
+                self._undo_credits[depth] = self.group_credits[group]
+                self._undo_points[depth] = self.group_points[group]
+                self.group_credits[group] += course.credits
+                self.group_points[group] += course.credits * course.grade
+        self._depth = depth + 1
+        self.counts.add_credits(counters, course.credits)
+        self.has_lab = self.has_lab or course._is_lab
+
+    def pop(self):
+        self._depth = depth = self._depth - 1
+        course = self._undo_courses[depth]
+        _, counters, group = self._undo_options[depth]
+        self.counts.add_credits(counters, -course.credits)
+        self.has_lab = self._undo_has_lab[depth]
+        if group is not None:
+            if course._is_passfail:
+                self.group_passfail_credits[group] = self._undo_credits[depth]
+            else:
+                self.group_credits[group] = self._undo_credits[depth]
+                self.group_points[group] = self._undo_points[depth]
+
+    def is_viable(self):
+        return self._is_satisfied(self.counts._counts)
+
+    def possibly_satisfiable(self, index):
+        # same check as possibly_satisfiable(self.courses[index:], self.assignments), adding up the counts
+        # element-wise instead of building a CreditCounts for them
+        return all(map(operator.ge, map(operator.add, self.counts._counts, self._optimistic_suffix[index]._counts),
+                       self._bounds))
+
+    def grade(self):
+        # same value as compute_grade(self.assignments)
+        return self.rules.grade_from_group_sums(self.group_credits, self.group_points)
+
+    def grade_signature(self):
+        # What sets the grade apart from other assignments: the group of every assigned graded course, and which lab
+        # (if any) is used. Where the other courses are listed doesn't matter.
+        return frozenset((course.index, option[2])
+                         for course, option in zip(self._undo_courses[:self._depth], self._undo_options)
+                         if (option[2] is not None and not course._is_passfail) or course._is_lab)
+
+    def grade_upper_bound(self, index):
+        # Best grade any completion of the courses from index onwards could reach. Each group gets its own best
+        # average, as if every remaining course could be put into every group at once, which can only overestimate.
+        rules = self.rules
+        total = 0.
+        for group, weight in enumerate(rules.weights):
+            credits = self.group_credits[group]
+            # graded credits the group still has to get to reach its credit minimum
+            missing = rules.group_min_credits[group] - credits - self.group_passfail_credits[group] - \
+                self._passfail_suffix[index][group]
+            total += weight * optimistic_group_average(credits, self.group_points[group], missing,
+                                                       self._group_candidates[group], index, self.has_lab)
+        return total / rules.weight_total
+
+
+class _OutOfBudget(Exception):
+    pass
+
+
+# how many nodes the search visits between looking at the clock
+BUDGET_CHECK_INTERVAL = 1024
+
+
+def greedy_assignment(courses, prefix=()):
+    # Dive straight down the search tree, always taking the choice with the best grade upper bound among the ones that
+    # can still satisfy the requirements. That's O(n^2) and usually gives a decent assignment, but it can run into a
+    # dead end, in which case this returns None. Otherwise it returns the grade and the assignments.
+    state = SearchState(courses)
+    for course, category in zip(state.courses, prefix):
+        if category is not None:
+            state.push(course, course.option(category))
+    for index in range(len(prefix), len(state.courses)):
+        course = state.courses[index]
+        best_bound = None
+        best_option = None
+        # None for leaving the course out; can't assign more than one lab
+        options = (course.options if not course._is_lab or not state.has_lab else ()) + (None,)
+        for option in options:
+            if option is not None:
+                state.push(course, option)
+            if state.possibly_satisfiable(index + 1):
+                bound = state.grade_upper_bound(index + 1)
+                if best_bound is None or bound > best_bound:
+                    best_bound = bound
+                    best_option = option
+            if option is not None:
+                state.pop()
+        if best_bound is None:
+            return None
+        if best_option is not None:
+            state.push(course, best_option)
+    # every step kept the requirements satisfiable, so this only fails if they never were
+    if not state.is_viable():
+        return None
+    return state.grade(), state.assignments
+
+
+class _IncrementalSearch:
+    def __init__(self, courses, shared_best=None, top_k=1, initial=None, memo_size=None, force_first=False):
+        self._state = SearchState(courses)
+        self._best_grade = None
+        self._best_assignments = None
+        # what a subtree has to beat to be worth searching: the best grade, or the k-th best one once we have k
+        self._cutoff_grade = None
+        # With top_k > 1, a min-heap of the best assignments so far as (grade, -evaluation number, grade signature,
+        # assignments), and the signatures in it. The evaluation number makes earlier assignments win ties, like for
+        # the best one.
+        self._top_k = top_k
+        self._top = [] if top_k > 1 else None
+        self._top_signatures = set()
+        self._evaluated = 0
+        self._worst_grade = None
+        self._pruned_nodes = 0
+        # best grade found by any of the parallel workers, see optimize_parallel
+        self._shared_best = shared_best
+        # (grade, assignments) to start from if it's better than the greedy one, see Optimizer. Unlike the greedy
+        # one, it's the incumbent: only strictly better assignments replace it.
+        self._initial = initial
+        # only search the assignments that use the first course, see Optimizer
+        self._force_first = force_first
+        # grade of the assignment we started from
+        self._initial_grade = None
+        # With memo_size, the (group credits, group points, group averages) of the partial assignments whose subtrees
+        # were searched, by (index, capped credit counts, lab flag), in an LRU table capped at memo_size entries (plus
+        # one per key). Partial assignments with the same key can be completed in exactly the same ways, so one that
+        # is dominated like in optimize_pareto can't lead to anything better than what we've already seen.
+        self._memo = OrderedDict() if memo_size else None
+        self._memo_size = memo_size
+        self._memo_entries = 0
+        self._memo_hits = 0
+        self._memo_misses = 0
+        self._grade_ranges = suffix_grade_ranges(self._state.courses) if memo_size else None
+        self._stats = None
+        self._nodes = 0
+        self._node_limit = None
+        self._deadline = None
+        self._next_budget_check = None
+
+    def run(self, prefix=()):
+        for result in self.improvements(prefix):
+            pass
+        return result
+
+    def improvements(self, prefix=(), time_limit=None, node_limit=None):
+        # Yields an OptimizationResult for the initial assignment (the greedy one, or the one passed in if that's
+        # better) and then for every better one the search finds, and finally the best one with result.optimal saying
+        # whether the search got to finish.
+        # prefix fixes the choices (category, or None to leave it out) for the first few courses
+        self._start = time.perf_counter()
+        if time_limit is not None:
+            self._deadline = self._start + time_limit
+        self._node_limit = node_limit
+        self._schedule_budget_check()
+        initial = None
+        # the initial assignment only tells us something about the best assignment, not the k-th best
+        if self._top is None:
+            initial = greedy_assignment(self._state.courses, prefix)
+            if self._initial is not None and (initial is None or self._initial[0] > initial[0]):
+                initial = self._initial
+        if initial is not None:
+            self._initial_grade = initial[0]
+            self._worst_grade = initial[0]
+            if self._initial is not None:
+                # the caller keeps its assignment on ties anyway, so we don't need to find them
+                self._best_grade, self._best_assignments = initial
+                self._cutoff_grade = initial[0]
+            yield self._result(*initial, optimal=False)
+        for course, category in zip(self._state.courses, prefix):
+            if category is not None:
+                self._state.push(course, course.option(category))
+
+        reported_grade = self._initial_grade
+        finished = True
+        try:
+            for _ in self._search(len(prefix)):
+                if reported_grade is None or self._best_grade > reported_grade + GRADE_TOLERANCE:
+                    reported_grade = self._best_grade
+                    yield self._result(self._best_grade, self._best_assignments, optimal=False)
+        except _OutOfBudget:
+            finished = False
+
+        # The search itself breaks ties like optimize_dfs, so prefer its assignment unless it got cut short before it
+        # could match the initial one.
+        if self._best_grade is not None and (initial is None or finished or self._best_grade >= initial[0]):
+            result = self._result(self._best_grade, self._best_assignments, optimal=finished)
+        elif initial is not None:
+            result = self._result(*initial, optimal=finished)
+        else:
+            result = OptimizationResult(False, None, None, None, self._pruned_nodes, self._memo_hits,
+                                        self._memo_misses)
+            result.optimal = finished
+        self._finish(result)
+        yield result
+
+    def _result(self, grade, assignments, optimal):
+        result = OptimizationResult(True, grade, assignments, self._worst_grade, self._pruned_nodes, self._memo_hits,
+                                    self._memo_misses)
+        result.optimal = optimal
+        if self._top is not None:
+            result.top_results = [OptimizationResult(True, top_grade, top_assignments, self._worst_grade,
+                                                     self._pruned_nodes)
+                                  for top_grade, _, _, top_assignments in sorted(self._top, reverse=True)]
+        return result
+
+    def _finish(self, result):
+        pass
+
+    def _schedule_budget_check(self):
+        if self._deadline is not None:
+            self._next_budget_check = self._nodes + BUDGET_CHECK_INTERVAL
+        if self._node_limit is not None:
+            self._next_budget_check = min(self._next_budget_check or self._node_limit + 1, self._node_limit + 1)
+
+    def _check_budget(self):
+        if self._node_limit is not None and self._nodes > self._node_limit:
+            raise _OutOfBudget()
+        if self._deadline is not None and time.perf_counter() >= self._deadline:
+            raise _OutOfBudget()
+        self._schedule_budget_check()
+
+    def _search(self, start):
+        # Depth-first search from the course at index start, with an explicit stack so that long course lists don't
+        # run into the recursion limit. Each level of the tree is one course, so the frame for course i is at index i
+        # of options_at (the categories to try, or none if that would be a second lab) and tried_at (how many children
+        # have been visited: one per option, and then one for leaving the course out). Yields (nothing) whenever the
+        # best assignment so far changes.
+        state = self._state
+        courses = state.courses
+        num_courses = len(courses)
+        options_at = [()] * (num_courses + 1)
+        tried_at = [0] * (num_courses + 1)
+        stats = self._stats
+        index = start
+        assigned = True
+        while True:
+            self._nodes += 1
+            if self._nodes == self._next_budget_check:
+                self._check_budget()
+            if stats is not None:
+                stats.count_node(index)
+            # Skipping a course doesn't change the assignment, so only evaluate after something was actually assigned.
+            # That way each assignment is evaluated once, at the same point optimize_dfs first sees it.
+            if assigned and state.is_viable():
+                grade = state.grade()
+                if self._worst_grade is None or grade < self._worst_grade:
+                    self._worst_grade = grade
+                if self._top is not None:
+                    self._keep_top(grade)
+                # ties go to the first assignment found, like in optimize_dfs
+                if self._best_grade is None or grade > self._best_grade:
+                    self._best_grade = grade
+                    self._best_assignments = state.assignments
+                    if self._top is None:
+                        self._cutoff_grade = grade
+                    if self._shared_best is not None:
+                        with self._shared_best.get_lock():
+                            self._shared_best.value = max(self._shared_best.value, grade)
+                    yield
+
+            expand = index != num_courses and state.possibly_satisfiable(index)
+            if expand and (self._cutoff_grade is not None or self._initial_grade is not None or
+                           self._shared_best is not None):
+                bound = state.grade_upper_bound(index)
+                # branch and bound: nothing below here can beat what we already have
+                if self._cutoff_grade is not None and bound <= self._cutoff_grade + GRADE_TOLERANCE:
+                    self._prune('bound')
+                    expand = False
+                # The greedy assignment, or the ones other workers found, might come later in the serial search
+                # order, so only give up if we can't even tie them, or we'd break ties differently than optimize_dfs.
+                elif self._initial_grade is not None and bound < self._initial_grade - GRADE_TOLERANCE:
+                    self._prune('bound')
+                    expand = False
+                elif self._shared_best is not None and bound < self._shared_best.value - GRADE_TOLERANCE:
+                    self._prune('shared_bound')
+                    expand = False
+            if expand and self._memo is not None and self._dominated(index):
+                self._prune('memo')
+                expand = False
+            if expand:
+                course = courses[index]
+                # can't assign more than one lab
+                options_at[index] = course.options if not course._is_lab or not state.has_lab else ()
+                tried_at[index] = 0
+            else:
+                index -= 1
+
+            # go to the next child of the deepest frame that has one left
+            while index >= start:
+                options = options_at[index]
+                tried = tried_at[index]
+                tried_at[index] = tried + 1
+                if 0 < tried <= len(options):
+                    state.pop()
+                if tried < len(options):
+                    state.push(courses[index], options[tried])
+                    assigned = True
+                    break
+                if tried == len(options) and not (index == start and self._force_first):
+                    assigned = False
+                    break
+                index -= 1
+            else:
+                return
+            index += 1
+
+    def _dominated(self, index):
+        # Looks the partial assignment up in the memo, and adds it if nothing there dominates it. Everything that was
+        # looked up before has had its subtree searched (or pruned) by the time another partial assignment gets here.
+        state = self._state
+        key = (index, state.rules.capped_values(state.counts), state.has_lab)
+        entry = (tuple(state.group_credits), tuple(state.group_points),
+                 tuple(points / credits if credits != 0. else 0.
+                       for credits, points in zip(state.group_credits, state.group_points)))
+        grade_ranges = self._grade_ranges[index]
+        entries = self._memo.get(key)
+        if entries is None:
+            entries = self._memo[key] = []
+            self._memo_entries += 1
+        else:
+            self._memo.move_to_end(key)
+            if any(_dominates(existing, entry, grade_ranges) for existing in entries):
+                self._memo_hits += 1
+                return True
+        self._memo_misses += 1
+        self._memo_entries -= len(entries)
+        _add_pareto_entry(entries, entry, grade_ranges)
+        self._memo_entries += len(entries)
+        # least recently used goes first
+        while self._memo_entries > self._memo_size and len(self._memo) > 1:
+            _, evicted = self._memo.popitem(last=False)
+            self._memo_entries -= len(evicted) + 1
+        return False
+
+    def _keep_top(self, grade):
+        # assignments with the same grade signature only differ in where ungraded courses are listed, so only the
+        # first one counts as an alternative
+        self._evaluated += 1
+        signature = self._state.grade_signature()
+        if signature in self._top_signatures:
+            return
+        if len(self._top) < self._top_k:
+            heapq.heappush(self._top, (grade, -self._evaluated, signature, self._state.assignments))
+            self._top_signatures.add(signature)
+        elif grade > self._top[0][0]:
+            replaced = heapq.heapreplace(self._top, (grade, -self._evaluated, signature, self._state.assignments))
+            self._top_signatures.discard(replaced[2])
+            self._top_signatures.add(signature)
+        if len(self._top) == self._top_k:
+            self._cutoff_grade = self._top[0][0]
+
+    def _prune(self, reason):
+        self._pruned_nodes += 1
+
+
+class SearchStats:
+    # Optional statistics for the incremental search. Pass one to optimize() as stats=...; it ends up in
+    # result.stats. The callback (if any) gets the stats every callback_interval nodes and once more at the end.
+    def __init__(self, callback=None, callback_interval=100000):
+        self.nodes_per_depth = []
+        self.prunes = {'infeasible': 0, 'bound': 0, 'shared_bound': 0, 'memo': 0}
+        self.assignments_evaluated = 0
+        self.feasibility_seconds = 0.
+        self.bound_seconds = 0.
+        self.grade_seconds = 0.
+        self.total_seconds = 0.
+        self.finished = False
+        self._callback = callback
+        self._callback_interval = callback_interval
+        self._nodes_since_callback = 0
+
+    @property
+    def nodes(self):
+        return sum(self.nodes_per_depth)
+
+    @property
+    def max_depth(self):
+        return len(self.nodes_per_depth) - 1
+
+    def count_node(self, depth):
+        while len(self.nodes_per_depth) <= depth:
+            self.nodes_per_depth.append(0)
+        self.nodes_per_depth[depth] += 1
+        self._nodes_since_callback += 1
+        if self._callback is not None and self._nodes_since_callback >= self._callback_interval:
+            self._nodes_since_callback = 0
+            self._callback(self)
+
+    def finish(self, seconds):
+        self.total_seconds += seconds
+        self.finished = True
+        if self._callback is not None:
+            self._callback(self)
+
+    def as_dict(self):
+        return {
+            'nodes': self.nodes,
+            'nodes_per_depth': list(self.nodes_per_depth),
+            'max_depth': self.max_depth,
+            'prunes': dict(self.prunes),
+            'assignments_evaluated': self.assignments_evaluated,
+            'feasibility_seconds': self.feasibility_seconds,
+            'bound_seconds': self.bound_seconds,
+            'grade_seconds': self.grade_seconds,
+            'total_seconds': self.total_seconds,
+            'finished': self.finished,
+        }
+
+
+class _InstrumentedSearchState(SearchState):
+    # SearchState that times its checks into a SearchStats. This is a separate class (like _InstrumentedSearch) so
+    # that searches without stats don't pay anything for them.
+    def __init__(self, courses, stats):
+        super().__init__(courses)
+        self._stats = stats
+
+    def is_viable(self):
+        start = time.perf_counter()
+        viable = super().is_viable()
+        self._stats.feasibility_seconds += time.perf_counter() - start
+        return viable
+
+    def possibly_satisfiable(self, index):
+        start = time.perf_counter()
+        satisfiable = super().possibly_satisfiable(index)
+        self._stats.feasibility_seconds += time.perf_counter() - start
+        if not satisfiable:
+            self._stats.prunes['infeasible'] += 1
+        return satisfiable
+
+    def grade(self):
+        start = time.perf_counter()
+        grade = super().grade()
+        self._stats.grade_seconds += time.perf_counter() - start
+        self._stats.assignments_evaluated += 1
+        return grade
+
+    def grade_upper_bound(self, index):
+        start = time.perf_counter()
+        bound = super().grade_upper_bound(index)
+        self._stats.bound_seconds += time.perf_counter() - start
+        return bound
+
+
+class _InstrumentedSearch(_IncrementalSearch):
+    def __init__(self, courses, stats, shared_best=None, top_k=1, initial=None, memo_size=None, force_first=False):
+        super().__init__(courses, shared_best, top_k, initial, memo_size, force_first)
+        self._state = _InstrumentedSearchState(courses, stats)
+        self._stats = stats
+
+    def _finish(self, result):
+        self._stats.finish(time.perf_counter() - self._start)
+        result.stats = self._stats
+
+    def _prune(self, reason):
+        super()._prune(reason)
+        self._stats.prunes[reason] += 1
+
+
+def optimize_anytime(courses, time_limit=None, node_limit=None, stats=None, top_k=1, heuristic_order=False):
+    # Generator version of optimize_incremental: yields a result for the greedy assignment, one for every better
+    # assignment found after that, and a last one (the best) with result.optimal set if the search finished within
+    # time_limit seconds and node_limit nodes.
+    if top_k < 1:
+        raise ValueError('top_k must be at least 1')
+    courses = compile_courses(courses)
+    if heuristic_order:
+        positions = {id(course.course): course.index for course in courses}
+        courses = order_courses(courses)
+    if stats is not None:
+        search = _InstrumentedSearch(courses, stats, top_k=top_k)
+    else:
+        search = _IncrementalSearch(courses, top_k=top_k)
+    results = search.improvements(time_limit=time_limit, node_limit=node_limit)
+    if heuristic_order:
+        return (_restore_order(result, positions) for result in results)
+    return results
+
+
+def optimize_incremental(courses, memo_size=None, stats=None, time_limit=None, node_limit=None, top_k=1,
+                         heuristic_order=False):
+    # memo_size turns on the memo of dominated partial assignments (see _IncrementalSearch), and caps how many
+    # entries it keeps around. With top_k > 1,
+    # result.top_results has the top_k best assignments, best first. heuristic_order searches in the order of
+    # order_courses, which usually finds good assignments much sooner, but can break ties differently.
+    courses = compile_courses(courses)
+    if memo_size:
+        if time_limit is not None or node_limit is not None or top_k != 1 or heuristic_order:
+            raise ValueError('The memoized search does not support time_limit, node_limit, top_k or heuristic_order')
+        search = _InstrumentedSearch(courses, stats, memo_size=memo_size) if stats is not None else \
+            _IncrementalSearch(courses, memo_size=memo_size)
+        return search.run()
+    for result in optimize_anytime(courses, time_limit, node_limit, stats, top_k, heuristic_order):
+        pass
+    return result
+
+
+# memo_size (see optimize_incremental) of the searches after an edit
+OPTIMIZER_MEMO_SIZE = 100000
+
+
+class Optimizer:
+    # Optimization session for a transcript that changes one course at a time. After an edit, the previous best
+    # assignment (adjusted for the edit) is the incumbent of the new search, and only what the edit could affect gets
+    # searched again: a new course only matters in assignments that use it, and removing a course that wasn't
+    # assigned changes nothing. Ties are kept with the previous assignment, so they can go differently than in
+    # optimize(). result and stats are from the last optimization.
+    def __init__(self, courses=(), rules=None):
+        self._courses = list(courses)
+        self._rules = rules or DEFAULT_RULES
+        self.result = None
+        self.stats = None
+
+    @property
+    def courses(self):
+        return list(self._courses)
+
+    def optimize(self):
+        self.stats = SearchStats()
+        return self._search(self._courses, None, self._warm_start())
+
+    def add_course(self, course):
+        self._courses.append(course)
+        if self.result is None:
+            return self.optimize()
+        self.stats = SearchStats()
+        return self._search(self._courses, course, self._warm_start())
+
+    def remove_course(self, course):
+        self._courses.remove(course)
+        if self.result is None:
+            return self.optimize()
+        if not self.result.possible or not self._is_assigned(course):
+            # the best assignment is still there, and taking a course away can't make anything better
+            self.stats = SearchStats()
+            self.stats.finish(0.)
+            return self.result
+        return self.optimize()
+
+    def update_course(self, old_course, new_course):
+        self._courses[self._courses.index(old_course)] = new_course
+        if self.result is None:
+            return self.optimize()
+        if self.result.possible and self._is_assigned(old_course):
+            if not _only_grade_improved(old_course, new_course):
+                return self.optimize()
+            # A better grade makes every assignment that uses the course better and leaves the others alone. So the
+            # previous best, with the new course in place of the old one, still beats everything without it.
+            initial = self._warm_start({id(old_course): new_course})
+        else:
+            # Without the new course, nothing changed. So either the best assignment is still the best one, or the
+            # new one uses the new course.
+            initial = self._warm_start()
+        self.stats = SearchStats()
+        return self._search(self._courses, new_course, initial)
+
+    def _is_assigned(self, course):
+        return any(assigned is course for courses in self.result.assignments.values() for assigned in courses)
+
+    def _warm_start(self, replaced=None):
+        # the previous best assignment, without the courses that aren't there anymore (or with the ones they were
+        # replaced with), if it still works
+        if self.result is None or not self.result.possible:
+            return None
+        replaced = replaced or {}
+        current = {id(course) for course in self._courses}
+        assignments = {category: [replaced.get(id(course), course) for course in assigned
+                                  if id(course) in current or id(course) in replaced]
+                       for category, assigned in self.result.assignments.items()}
+        labs = sum(course._is_lab for assigned in assignments.values() for course in assigned)
+        if labs > 1 or not self._rules.satisfied(self._rules.credit_counts(assignments)):
+            return None
+        return self._rules.grade(assignments), assignments
+
+    def _search(self, courses, forced_course, initial):
+        # Searches in heuristic order, with the previous best assignment as the incumbent. With forced_course, only
+        # the assignments that use it are searched: it goes first, and the root of the search doesn't leave it out.
+        positions = {id(course): index for index, course in enumerate(courses)}
+        if forced_course is None:
+            ordered = order_courses(compile_courses(courses, self._rules))
+        else:
+            ordered = compile_courses([forced_course] + [course.course for course in order_courses(compile_courses(
+                [course for course in courses if course is not forced_course], self._rules))], self._rules)
+        result = _InstrumentedSearch(ordered, self.stats, initial=initial, memo_size=OPTIMIZER_MEMO_SIZE,
+                                     force_first=forced_course is not None).run()
+        # keep the previous assignment on ties, even with a greedy one that's just as good
+        if initial is not None and (not result.possible or result.max_grade <= initial[0] + GRADE_TOLERANCE):
+            result = OptimizationResult(True, initial[0], initial[1], result.worst_grade or initial[0],
+                                        result.pruned_nodes)
+        result.stats = self.stats
+        self.result = _restore_order(result, positions)
+        return self.result
+
+
+def _only_grade_improved(old_course, new_course):
+    return (new_course.credits == old_course.credits and new_course.categories == old_course.categories and
+            new_course._is_lab == old_course._is_lab and new_course._is_passfail == old_course._is_passfail and
+            (new_course._is_passfail or new_course.grade >= old_course.grade))
+
+
+def undominated_options(course, rules=None):
+    # The categories worth trying for a course, plus None for leaving it out. Credits never hurt, so an option is
+    # pointless if another one feeds the same grade group (or none) and gives at least as many credits everywhere.
+    return _undominated_options(list(dict.fromkeys(course.categories)), course._is_lab, rules or DEFAULT_RULES)
+
+
+def _undominated_options(categories, is_lab, rules):
+    options = list(categories) + [None]
+    no_credits = (0,) * rules.num_counters
+
+    def dominates(option, other):
+        # leaving a lab out keeps the lab slot free, so that can't be compared to assigning it
+        if is_lab and (option is None) != (other is None):
+            return False
+        group = rules.category_groups[option] if option is not None else None
+        other_group = rules.category_groups[other] if other is not None else None
+        if group != other_group:
+            return False
+        credits = rules.incidence[option] if option is not None else no_credits
+        other_credits = rules.incidence[other] if other is not None else no_credits
+        return all(value >= other_value for value, other_value in zip(credits, other_credits))
+
+    undominated = []
+    for i, option in enumerate(options):
+        # of two equivalent options, keep the first one
+        if not any(dominates(other, option) and (j < i or not dominates(option, other))
+                   for j, other in enumerate(options) if j != i):
+            undominated.append(option)
+    return undominated
+
+
+def _dominates(entry, other, grade_ranges):
+    # Does entry give at least the same average in every group as other, no matter which graded courses with grades in
+    # grade_ranges[group] get added to both later on? Adding c credits averaging r to both groups, the difference in
+    # averages has the sign of (points * other_credits - other_points * credits) + c * (points - other_points -
+    # r * (credits - other_credits)), so it's enough to check c = 0 and the two extreme grades.
+    credits, points, averages = entry[0], entry[1], entry[2]
+    other_credits, other_points, other_averages = other[0], other[1], other[2]
+    for group, (min_grade, max_grade) in enumerate(grade_ranges):
+        if averages[group] < other_averages[group]:
+            return False
+        if min_grade is None:
+            # nothing can be added to this group anymore
+            continue
+        credits_difference = credits[group] - other_credits[group]
+        points_difference = points[group] - other_points[group]
+        if credits_difference > 0:
+            if points_difference < max_grade * credits_difference:
+                return False
+        elif points_difference < min_grade * credits_difference:
+            return False
+    return True
+
+
+def _add_pareto_entry(entries, entry, grade_ranges):
+    for existing in entries:
+        if _dominates(existing, entry, grade_ranges):
+            return
+    entries[:] = [existing for existing in entries if not _dominates(entry, existing, grade_ranges)]
+    entries.append(entry)
+
+
+def _entry_upper_bound(entry, candidates, passfail_credits, index, has_lab, rules):
+    # like SearchState.grade_upper_bound
+    credits, points = entry[0], entry[1]
+    total = 0.
+    for group, weight in enumerate(rules.weights):
+        missing = rules.group_min_credits[group] - credits[group] - passfail_credits[group]
+        total += weight * optimistic_group_average(credits[group], points[group], missing, candidates[group], index,
+                                                   has_lab)
+    return total / rules.weight_total
+
+
+def optimize_pareto(courses):
+    # Dynamic programming over the courses in order. Partial assignments with the same capped credit counts and lab
+    # flag can be completed in exactly the same ways, so for each such state we only need to keep the per-group
+    # (graded credits, grade points) tuples that aren't dominated by another tuple for every possible completion.
+    # Entries are (group credits, group points, group averages, choices), where choices is a linked list of
+    # (category, course index, previous choices).
+    courses = compile_courses(courses)
+    rules = courses.rules
+    candidates = group_candidates(courses)
+    # Pass/fail credits can count towards a group's credit minimum. We don't track where they went, so for the bound
+    # just assume all of them could still end up in the group.
+    passfail_credits = [0.] * len(rules.grade_groups)
+    for course in courses:
+        if course._is_passfail:
+            for group in course.groups:
+                passfail_credits[group] += course.credits
+    # range of grades the remaining courses could still add to each group
+    grade_ranges_at = suffix_grade_ranges(courses)
+    # optimistic credits each suffix could still add, to drop states that can't be completed anymore
+    optimistic_suffix = optimistic_suffix_counts(courses)
+
+    best_grade = None
+    best_choices = None
+    worst_grade = None
+    empty_group_sums = (0.,) * len(rules.grade_groups)
+    states = {(rules.capped_values(rules.empty_counts()), False): [(empty_group_sums, empty_group_sums,
+                                                                    empty_group_sums, None)]}
+    for index, course in enumerate(courses):
+        grade_ranges = grade_ranges_at[index + 1]
+        options = course.undominated
+        next_states = {}
+        for (capped, has_lab), entries in states.items():
+            # can't assign more than one lab
+            if not course._is_lab or not has_lab:
+                for category in options:
+                    if category is None:
+                        continue
+                    _, counters, group = course.option(category)
+                    counts = CreditCounts.from_values(capped)
+                    counts.add_credits(counters, course.credits)
+                    if not rules.satisfied(counts + optimistic_suffix[index + 1]):
+                        continue
+                    key = (rules.capped_values(counts), has_lab or course._is_lab)
+                    next_entries = next_states.setdefault(key, [])
+                    for credits, points, averages, choices in entries:
+                        if group is not None and not course._is_passfail:
+                            group_credits = credits[group] + course.credits
+                            group_points = points[group] + course.credits * course.grade
+                            credits = credits[:group] + (group_credits,) + credits[group + 1:]
+                            points = points[:group] + (group_points,) + points[group + 1:]
+                            averages = averages[:group] + (group_points / group_credits,) + averages[group + 1:]
+                        _add_pareto_entry(next_entries, (credits, points, averages, (category, index, choices)),
+                                          grade_ranges)
+            # also consider not listing this course at all
+            if None not in options:
+                continue
+            if not rules.satisfied(CreditCounts.from_values(capped) + optimistic_suffix[index + 1]):
+                continue
+            next_entries = next_states.setdefault((capped, has_lab), [])
+            for entry in entries:
+                _add_pareto_entry(next_entries, entry, grade_ranges)
+
+        # Entries in states that already satisfy all minimums are complete assignments (leaving out the rest)
+        for (capped, _), entries in next_states.items():
+            if rules.satisfied(CreditCounts.from_values(capped)):
+                for credits, points, _, choices in entries:
+                    grade = rules.grade_from_group_sums(credits, points)
+                    if best_grade is None or grade > best_grade:
+                        best_grade = grade
+                        best_choices = choices
+                    if worst_grade is None or grade < worst_grade:
+                        worst_grade = grade
+        # and give us a bound to drop entries that can't get any better than that
+        if best_grade is not None:
+            for (capped, has_lab), entries in next_states.items():
+                entries[:] = [entry for entry in entries
+                              if _entry_upper_bound(entry, candidates, passfail_credits, index + 1, has_lab, rules) >
+                              best_grade + GRADE_TOLERANCE]
+        states = {key: entries for key, entries in next_states.items() if entries}
+
+    if best_grade is None:
+        return OptimizationResult(False, None, None, None)
+    chosen = []
+    while best_choices is not None:
+        category, index, best_choices = best_choices
+        chosen.append((index, category))
+    assignments = {category: [] for category in Category}
+    for index, category in sorted(chosen):
+        assignments[category].append(courses[index].course)
+    return OptimizationResult(True, best_grade, assignments, worst_grade)
+
+
+# per-process state of the optimize_parallel workers
+_worker_courses = None
+_worker_shared_best = None
+
+
+def _init_parallel_worker(courses, shared_best):
+    global _worker_courses, _worker_shared_best
+    _worker_courses = courses
+    _worker_shared_best = shared_best
+
+
+def _search_work_unit(prefix):
+    result = _IncrementalSearch(_worker_courses, _worker_shared_best).run(prefix)
+    # the courses got pickled on the way here, so send back positions rather than Course objects
+    if result.possible:
+        positions = {id(course.course): course.index for course in _worker_courses}
+        result.assignments = {category: [positions[id(course)] for course in assigned]
+                              for category, assigned in result.assignments.items()}
+    return result
+
+
+def _work_units(courses, split_depth):
+    # the choices for the first split_depth courses, in the order the serial search would try them
+    state = SearchState(courses)
+    units = []
+
+    def expand(index, prefix):
+        if index == split_depth or index == len(courses) or not state.possibly_satisfiable(index):
+            units.append(prefix)
+            return
+        course = courses[index]
+        if not course._is_lab or not state.has_lab:
+            for option in course.options:
+                state.push(course, option)
+                expand(index + 1, prefix + (option[0],))
+                state.pop()
+        expand(index + 1, prefix + (None,))
+
+    expand(0, ())
+    return units
+
+
+def optimize_parallel(courses, workers=None, split_depth=None, measure_speedup=False):
+    # Splits the search tree after the first few courses and searches the pieces in a process pool. The workers share
+    # the best grade found so far, so they can prune with each other's results. The pieces are merged in the serial
+    # search order, so ties are broken the same way as in optimize_incremental.
+    courses = compile_courses(courses)
+    workers = workers or os.cpu_count() or 1
+    if split_depth is None:
+        # enough pieces to keep all workers busy even if some of them are pruned right away
+        split_depth = 0
+        while split_depth < len(courses) and len(_work_units(courses, split_depth)) < 8 * workers:
+            split_depth += 1
+    units = _work_units(courses, split_depth)
+
+    serial_seconds = None
+    if measure_speedup:
+        start = time.perf_counter()
+        optimize_incremental(courses)
+        serial_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    shared_best = multiprocessing.Value('d', float('-inf'))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_parallel_worker,
+                             initargs=(courses, shared_best)) as executor:
+        unit_results = list(executor.map(_search_work_unit, units))
+    parallel_seconds = time.perf_counter() - start
+
+    best = None
+    worst_grade = None
+    pruned_nodes = 0
+    for unit_result in unit_results:
+        pruned_nodes += unit_result.pruned_nodes
+        if not unit_result.possible:
+            continue
+        if best is None or unit_result.max_grade > best.max_grade:
+            best = unit_result
+        if worst_grade is None or unit_result.worst_grade < worst_grade:
+            worst_grade = unit_result.worst_grade
+    if best is None:
+        result = OptimizationResult(False, None, None, None, pruned_nodes)
+    else:
+        assignments = {category: [courses[index].course for index in assigned]
+                       for category, assigned in best.assignments.items()}
+        result = OptimizationResult(True, best.max_grade, assignments, worst_grade, pruned_nodes)
+    if serial_seconds is not None:
+        result.speedup = serial_seconds / parallel_seconds
+    return result
+
+
+def _optimize_milp(courses):
+    # scipy is only needed for this engine, so don't import it unless someone asks for it
+    import milp_optimizer
+    return milp_optimizer.optimize_milp(courses)
+
+
+def _optimize_vectorized(courses, **options):
+    # same for numpy
+    import vectorized_optimizer
+    return vectorized_optimizer.optimize_vectorized(courses, **options)
+
+
+ENGINES = {
+    'dfs': _optimize_dfs,
+    'incremental': optimize_incremental,
+    'milp': _optimize_milp,
+    'pareto': optimize_pareto,
+    'parallel': optimize_parallel,
+    'vectorized': _optimize_vectorized,
+}
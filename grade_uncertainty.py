@@ -0,0 +1,283 @@
+import numpy as np
+
+import course_optimizer as co
+
+# grades are given in quarter steps, so a (low, high) range means every quarter step in between
+GRADE_STEP = 0.25
+# scenarios are evaluated a block at a time, so (candidate assignments) x (scenarios per block) stays around this
+SCENARIO_BLOCK_SIZE = 1 << 22
+
+
+class GradeDistribution:
+    def __init__(self, possible, pending_courses, scenarios, scenario_grades, assignments, scenario_assignments):
+        self.possible = possible
+        # the pending courses in the order they're listed in the courses (not in pending's), which is the column order
+        # of scenarios
+        self.pending_courses = pending_courses
+        # sampled grades of the pending courses, one row per scenario and one column per pending course
+        self.scenarios = scenarios
+        # best final grade of each scenario
+        self.scenario_grades = scenario_grades
+        # the assignments that are optimal in at least one scenario, most often optimal first
+        self.assignments = assignments
+        # index into assignments of the optimal assignment of each scenario
+        self.scenario_assignments = scenario_assignments
+
+    @property
+    def frequencies(self):
+        # how often each of the assignments is optimal
+        if not self.possible:
+            return np.zeros(0)
+        return np.bincount(self.scenario_assignments, minlength=len(self.assignments)) / len(self.scenario_grades)
+
+    @property
+    def mean(self):
+        return float(self.scenario_grades.mean()) if self.possible else None
+
+    def percentile(self, q):
+        return float(np.percentile(self.scenario_grades, q)) if self.possible else None
+
+
+def sample_grades(distribution, num_scenarios, rng):
+    # distribution is either a (low, high) range, or a {grade: weight} dict
+    if isinstance(distribution, dict):
+        grades = np.array(list(distribution.keys()), dtype=float)
+        weights = np.array(list(distribution.values()), dtype=float)
+        return rng.choice(grades, size=num_scenarios, p=weights / weights.sum())
+    low, high = distribution
+    if high < low:
+        raise ValueError('Grade range (' + str(low) + ', ' + str(high) + ') is empty')
+    steps = int(round((high - low) / GRADE_STEP))
+    return low + GRADE_STEP * rng.integers(0, steps + 1, size=num_scenarios)
+
+
+def _with_grades(courses, grades):
+    # copies of the compiled courses with other grades (they still point at the original courses)
+    copies = co.CompiledCourses([co.CompiledCourse(course.course, course.index, course.categories, courses.rules)
+                                 for course in courses], courses.rules)
+    for course, grade in zip(copies, grades):
+        if not course._is_passfail:
+            course.grade = float(grade)
+    return copies
+
+
+def _worst_case(constant, coefficients, pending_ranges):
+    # lowest value of constant + sum(coefficient * pending grade) over all pending grades in their ranges
+    return constant + sum(coefficient * (low if coefficient > 0. else high)
+                          for coefficient, (low, high) in zip(coefficients, pending_ranges) if coefficient != 0.)
+
+
+def _dominates(entry, other, grade_ranges, pending_credits, pending_ranges):
+    # Like course_optimizer._dominates, but the pending grades can be anything in their ranges, and the check has to
+    # hold for all of them. The points of a group are its known points plus credits * grade for every pending course
+    # in it, so every difference the check looks at is linear in the pending grades, and its worst case is at the
+    # ends of their ranges.
+    credits, points, pending_groups = entry[0], entry[1], entry[2]
+    other_credits, other_points, other_pending_groups = other[0], other[1], other[2]
+    for group, (min_grade, max_grade) in enumerate(grade_ranges):
+        in_group = [pending_credits[i] if pending_group == group else 0.
+                    for i, pending_group in enumerate(pending_groups)]
+        other_in_group = [pending_credits[i] if pending_group == group else 0.
+                          for i, pending_group in enumerate(other_pending_groups)]
+        # the averages as they are: points * other_credits - other_points * credits >= 0
+        if credits[group] == 0.:
+            if other_credits[group] != 0.:
+                return False
+        elif other_credits[group] != 0. and _worst_case(
+                points[group] * other_credits[group] - other_points[group] * credits[group],
+                [value * other_credits[group] - other_value * credits[group]
+                 for value, other_value in zip(in_group, other_in_group)], pending_ranges) < 0.:
+            return False
+        if min_grade is None:
+            # nothing can be added to this group anymore
+            continue
+        credits_difference = credits[group] - other_credits[group]
+        points_difference = _worst_case(points[group] - other_points[group],
+                                        [value - other_value for value, other_value in zip(in_group, other_in_group)],
+                                        pending_ranges)
+        if points_difference < (max_grade if credits_difference > 0 else min_grade) * credits_difference:
+            return False
+    return True
+
+
+def _add_entry(entries, entry, grade_ranges, pending_credits, pending_ranges):
+    for existing in entries:
+        if _dominates(existing, entry, grade_ranges, pending_credits, pending_ranges):
+            return
+    entries[:] = [existing for existing in entries
+                  if not _dominates(entry, existing, grade_ranges, pending_credits, pending_ranges)]
+    entries.append(entry)
+
+
+def _candidate_signatures(courses, pending_indices, low_grades, high_grades):
+    # The assignments that can be optimal in some scenario, by dynamic programming over the courses like
+    # optimize_pareto. The pending grades are only known to be in their [low, high] ranges, so an entry tracks the
+    # known points of each group and the group of every pending course, and only gets dropped if another one is at
+    # least as good for all pending grades. The final grade only goes up when a course grade does, so an entry that
+    # can't even get the best grade there is with all pending grades at their lowest (with all of them at their
+    # highest) gets dropped, too.
+    # Returns one row per candidate signature, with the group of every course (-1 for none, or for pass/fail
+    # courses), and the assignment it comes from. Candidates are in the order the incremental search would find
+    # them, so earlier assignments win ties like in the other engines.
+    rules = courses.rules
+    low = co.optimize_pareto(_with_grades(courses, low_grades))
+    if not low.possible:
+        return None, None
+    high_courses = _with_grades(courses, high_grades)
+    candidates = co.group_candidates(high_courses)
+    passfail_credits = [0.] * len(rules.grade_groups)
+    for course in courses:
+        if course._is_passfail:
+            for group in course.groups:
+                passfail_credits[group] += course.credits
+    grade_ranges_at = [tuple((low_range[0], high_range[1]) for low_range, high_range in zip(low_ranges, high_ranges))
+                       for low_ranges, high_ranges in zip(co.suffix_grade_ranges(_with_grades(courses, low_grades)),
+                                                          co.suffix_grade_ranges(high_courses))]
+    optimistic_suffix = co.optimistic_suffix_counts(courses)
+    pending_position = {index: position for position, index in enumerate(pending_indices)}
+    pending_credits = [courses[index].credits for index in pending_indices]
+    pending_ranges = [(low_grades[index], high_grades[index]) for index in pending_indices]
+
+    def upper_bound(entry, index, has_lab):
+        credits, points, pending_groups = entry[0], entry[1], entry[2]
+        high_points = list(points)
+        for position, group in enumerate(pending_groups):
+            if group >= 0:
+                high_points[group] += pending_credits[position] * pending_ranges[position][1]
+        return co._entry_upper_bound((credits, high_points), candidates, passfail_credits, index, has_lab, rules)
+
+    complete = {}
+    empty_group_sums = (0.,) * len(rules.grade_groups)
+    states = {(rules.capped_values(rules.empty_counts()), False): [(empty_group_sums, empty_group_sums,
+                                                                    (-1,) * len(pending_indices), None)]}
+    for index, course in enumerate(courses):
+        grade_ranges = grade_ranges_at[index + 1]
+        next_states = {}
+        for (capped, has_lab), entries in states.items():
+            # can't assign more than one lab
+            if not course._is_lab or not has_lab:
+                for category in course.undominated:
+                    if category is None:
+                        continue
+                    _, counters, group = course.option(category)
+                    counts = co.CreditCounts.from_values(capped)
+                    counts.add_credits(counters, course.credits)
+                    if not rules.satisfied(counts + optimistic_suffix[index + 1]):
+                        continue
+                    next_entries = next_states.setdefault((rules.capped_values(counts), has_lab or course._is_lab), [])
+                    for credits, points, pending_groups, choices in entries:
+                        if group is not None and not course._is_passfail:
+                            credits = credits[:group] + (credits[group] + course.credits,) + credits[group + 1:]
+                            if index in pending_position:
+                                position = pending_position[index]
+                                pending_groups = pending_groups[:position] + (group,) + pending_groups[position + 1:]
+                            else:
+                                points = points[:group] + (points[group] + course.credits * course.grade,) + \
+                                    points[group + 1:]
+                        _add_entry(next_entries, (credits, points, pending_groups, (category, index, choices)),
+                                   grade_ranges, pending_credits, pending_ranges)
+            # also consider not listing this course at all
+            if None not in course.undominated:
+                continue
+            if not rules.satisfied(co.CreditCounts.from_values(capped) + optimistic_suffix[index + 1]):
+                continue
+            next_entries = next_states.setdefault((capped, has_lab), [])
+            for entry in entries:
+                _add_entry(next_entries, entry, grade_ranges, pending_credits, pending_ranges)
+
+        for (capped, has_lab), entries in next_states.items():
+            entries[:] = [entry for entry in entries
+                          if upper_bound(entry, index + 1, has_lab) >= low.max_grade - co.GRADE_TOLERANCE]
+            # entries that already satisfy all minimums are complete assignments (leaving out the rest)
+            if rules.satisfied(co.CreditCounts.from_values(capped)):
+                for entry in entries:
+                    chosen = {}
+                    choices = entry[3]
+                    while choices is not None:
+                        category, chosen_index, choices = choices
+                        chosen[chosen_index] = category
+                    # the incremental search tries a course's categories in order, then leaving it out
+                    order = tuple(course.categories.index(chosen[course.index]) if course.index in chosen
+                                  else len(course.categories) for course in courses)
+                    complete.setdefault(order, chosen)
+        states = {key: entries for key, entries in next_states.items() if entries}
+
+    signatures = {}
+    for order in sorted(complete):
+        chosen = complete[order]
+        signature = np.full(len(courses), -1)
+        for index, category in chosen.items():
+            group = rules.category_groups[category]
+            if group is not None and not courses[index]._is_passfail:
+                signature[index] = group
+        assignment = {category: [] for category in co.Category}
+        for index in sorted(chosen):
+            assignment[chosen[index]].append(courses[index].course)
+        signatures.setdefault(signature.tobytes(), (signature, assignment))
+    return (np.array([signature for signature, _ in signatures.values()]),
+            [assignment for _, assignment in signatures.values()])
+
+
+def _signature_grades(signatures, credits, grades, rules):
+    # final grade of every signature (rows) for every column of course grades
+    weights = np.array(rules.weights) / rules.weight_total
+    total = np.zeros((len(signatures), grades.shape[1]))
+    for group in range(len(rules.grade_groups)):
+        group_credits = np.where(signatures == group, credits, 0.)
+        credit_sums = group_credits.sum(axis=1)
+        points = group_credits @ grades
+        total += weights[group] * np.divide(points, credit_sums[:, None], out=np.zeros_like(points),
+                                            where=credit_sums[:, None] != 0.)
+    return total
+
+
+def analyze_grade_uncertainty(courses, pending, num_scenarios=10000, seed=None, rules=None):
+    # pending maps some of the courses to the distribution of their grade (see sample_grades). Samples num_scenarios
+    # sets of grades for them, and finds the best assignment of each scenario under rules (the default rules if not
+    # given).
+    courses = co.compile_courses(courses, rules)
+    rules = courses.rules
+    pending_indices = []
+    for course in courses:
+        if course.course in pending:
+            if course._is_passfail:
+                raise ValueError('Pass/fail course ' + str(course) + ' has no grade to be uncertain about')
+            pending_indices.append(course.index)
+    rng = np.random.default_rng(seed)
+    scenarios = np.column_stack([sample_grades(pending[courses[index].course], num_scenarios, rng)
+                                 for index in pending_indices]) if pending_indices else np.zeros((num_scenarios, 0))
+
+    credits = np.array([course.credits for course in courses], dtype=float)
+    known_grades = np.array([course.grade if course.grade is not None and not course._is_passfail else 0.
+                             for course in courses])
+    extremes = np.repeat(known_grades[:, None], 2, axis=1)
+    if pending_indices:
+        extremes[pending_indices, 0] = scenarios.min(axis=0)
+        extremes[pending_indices, 1] = scenarios.max(axis=0)
+    signatures, candidate_assignments = _candidate_signatures(courses, pending_indices, extremes[:, 0],
+                                                              extremes[:, 1])
+    pending_courses = [courses[index].course for index in pending_indices]
+    if signatures is None:
+        return GradeDistribution(False, pending_courses, scenarios, np.zeros(0), [], np.zeros(0, dtype=np.int64))
+
+    scenario_grades = np.empty(num_scenarios)
+    best_signatures = np.empty(num_scenarios, dtype=np.int64)
+    block = max(1, SCENARIO_BLOCK_SIZE // len(signatures))
+    for start in range(0, num_scenarios, block):
+        stop = min(start + block, num_scenarios)
+        grades = np.repeat(known_grades[:, None], stop - start, axis=1)
+        if pending_indices:
+            grades[pending_indices, :] = scenarios[start:stop].T
+        block_grades = _signature_grades(signatures, credits, grades, rules)
+        best = np.argmax(block_grades, axis=0)
+        best_signatures[start:stop] = best
+        scenario_grades[start:stop] = block_grades[best, np.arange(stop - start)]
+
+    # number the optimal assignments by how often they're optimal
+    used, scenario_assignments, counts = np.unique(best_signatures, return_inverse=True, return_counts=True)
+    ranking = np.argsort(-counts, kind='stable')
+    rank_of = np.empty(len(ranking), dtype=np.int64)
+    rank_of[ranking] = np.arange(len(ranking))
+    assignments = [candidate_assignments[signature] for signature in used[ranking]]
+    return GradeDistribution(True, pending_courses, scenarios, scenario_grades, assignments,
+                             rank_of[scenario_assignments.reshape(-1)])
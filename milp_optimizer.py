@@ -0,0 +1,126 @@
+import numpy as np
+from scipy.optimize import Bounds, LinearConstraint, milp
+
+import course_optimizer as co
+
+# strict counters (like core focus) need more credits than their minimum, not just as many
+STRICT_MARGIN = 1e-3
+
+
+class _Model:
+    def __init__(self):
+        self.num_variables = 0
+        self.lower_bounds = []
+        self.upper_bounds = []
+        self.rows = []
+        self.lower = []
+        self.upper = []
+
+    def add_variables(self, count, lower_bound=0., upper_bound=1.):
+        first = self.num_variables
+        self.num_variables += count
+        self.lower_bounds += [lower_bound] * count
+        self.upper_bounds += [upper_bound] * count
+        return list(range(first, first + count))
+
+    def add_constraint(self, coefficients, lower, upper):
+        self.rows.append(coefficients)
+        self.lower.append(lower)
+        self.upper.append(upper)
+
+    def matrix(self):
+        matrix = np.zeros((len(self.rows), self.num_variables))
+        for row, coefficients in enumerate(self.rows):
+            for variable, coefficient in coefficients:
+                matrix[row, variable] += coefficient
+        return matrix
+
+
+def optimize_milp(courses):
+    # The objective is a weighted sum of per-group averages N_g / D_g, which isn't linear. Like in 0-1 fractional
+    # programming, each group gets a variable u_g = L_g / D_g instead, where L_g is the least D_g can be, so that
+    # N_g / D_g = N_g * u_g / L_g. N_g and D_g are sums of credits times binaries, so every product of u_g with a
+    # binary gets its own variable z with the (exact, for binary x) McCormick constraints. Maximizing the objective
+    # pushes u_g up to the bound sum(credits * z) <= L_g, which makes it L_g / D_g. Since D_g can't be below L_g or
+    # above the credits of all the group's candidates, u_g has tight bounds, and so does the LP relaxation.
+    courses = co.compile_courses(courses)
+    rules = courses.rules
+    model = _Model()
+    contributions = rules.incidence
+
+    # x[i][category] is 1 if course i is assigned to that category
+    x = []
+    for course in courses:
+        x.append(dict(zip(course.categories, model.add_variables(len(course.categories)))))
+    num_binaries = model.num_variables
+    if num_binaries == 0:
+        return co.OptimizationResult(False, None, None, None)
+
+    for course_variables in x:
+        model.add_constraint([(variable, 1.) for variable in course_variables.values()], -np.inf, 1.)
+
+    # can't assign more than one lab
+    lab_variables = [variable for course, course_variables in zip(courses, x) if course._is_lab
+                     for variable in course_variables.values()]
+    if len(lab_variables) > 1:
+        model.add_constraint([(variable, 1.) for variable in lab_variables], -np.inf, 1.)
+
+    for counter, (min_credits, strict) in enumerate(zip(rules.min_counts, rules.strict)):
+        if strict:
+            min_credits += STRICT_MARGIN
+        model.add_constraint([(variable, course.credits * contributions[category][counter])
+                              for course, course_variables in zip(courses, x)
+                              for category, variable in course_variables.items()], min_credits, np.inf)
+
+    objective = []
+    for group, ((categories, weight), min_credits) in enumerate(zip(rules.grade_groups, rules.group_min_credits)):
+        # the graded courses that could go into the group, with their variables for it (credit-less courses don't
+        # change the average)
+        candidates = [(course, [variable for category, variable in course_variables.items() if category in categories])
+                      for course, course_variables in zip(courses, x) if not course._is_passfail and course.credits > 0]
+        candidates = [(course, in_group) for course, in_group in candidates if in_group]
+        if not candidates:
+            continue
+        passfail_credits = sum(course.credits for course in courses if course._is_passfail and group in course.groups)
+        # graded credits the group needs at least, if it has any at all
+        least_credits = max(min(course.credits for course, _ in candidates), min_credits - passfail_credits)
+        # if pass/fail courses can cover the minimum, the group can stay empty, with an average of 0
+        least_u = least_credits / sum(course.credits for course, _ in candidates) \
+            if min_credits - passfail_credits > 0 else 0.
+        u = model.add_variables(1, least_u, 1.)[0]
+        denominator = []
+        for course, in_group in candidates:
+            z = model.add_variables(1, 0., 1.)[0]
+            denominator.append((z, course.credits))
+            objective.append((z, weight / rules.weight_total * course.credits * course.grade / least_credits))
+            # z = u_g * (course is in the group)
+            model.add_constraint([(z, 1.)] + [(variable, -1.) for variable in in_group], -np.inf, 0.)
+            model.add_constraint([(z, 1.)] + [(variable, -least_u) for variable in in_group], 0., np.inf)
+            model.add_constraint([(z, 1.), (u, -1.)] + [(variable, -least_u) for variable in in_group], -np.inf,
+                                 -least_u)
+            model.add_constraint([(z, 1.), (u, -1.)] + [(variable, -1.) for variable in in_group], -1., np.inf)
+        model.add_constraint(denominator, -np.inf, least_credits)
+
+    objective_vector = np.zeros(model.num_variables)
+    for variable, coefficient in objective:
+        objective_vector[variable] -= coefficient
+    integrality = np.zeros(model.num_variables)
+    integrality[:num_binaries] = 1
+    constraints = LinearConstraint(model.matrix(), model.lower, model.upper)
+    solution = milp(objective_vector, integrality=integrality, bounds=Bounds(model.lower_bounds, model.upper_bounds),
+                    constraints=constraints,
+                    options={'mip_rel_gap': 0.})
+
+    if solution.x is None:
+        return co.OptimizationResult(False, None, None, None)
+
+    assignments = {category: [] for category in co.Category}
+    for course, course_variables in zip(courses, x):
+        for category, variable in course_variables.items():
+            if solution.x[variable] > 0.5:
+                assignments[category].append(course.course)
+    # the solver works with tolerances, so double check the rounded assignment against the real rules
+    if not rules.satisfied(rules.credit_counts(assignments)):
+        raise RuntimeError('MILP solver returned an assignment that does not satisfy the credit requirements')
+    grade = rules.grade(assignments)
+    return co.OptimizationResult(True, grade, assignments, grade)
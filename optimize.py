@@ -4,7 +4,7 @@ import time
 import course_optimizer as co
 
 
-def main():
+def sample_courses():
     # Some general notes:
     # -Only one (non-interfocus) lab course can be counted. The optimization takes this into account, so label all your
     #  non-interfocus lab courses as such.
@@ -14,7 +14,7 @@ def main():
     #  explicitly, but the department doesn't like it when you get a lot of seminar credits. So don't label those as
     #  electives.
     # -If you're a masochist and take all 3 interfocus labs, I'm not sure if you can count one as an elective or not.
-    courses = [
+    return [
         co.Course("Intro to FizzBuzz", 4.75, 8, co.Category.CORE_FOCUS, co.Category.ELECTIVE, co.Category.ELECTIVE_CS,
                   co.Category.ELECTIVE),
         co.Course("How to Design Manhole Covers", 4.0, 6, co.Category.CORE_FOCUS, co.Category.ELECTIVE_CS,
@@ -37,6 +37,9 @@ def main():
         co.Course("Buzzing and Fizzing: What's next?", 5.5, 30, co.Category.THESIS),
     ]
 
+
+def main():
+    courses = sample_courses()
     print('=========================================')
     print('Considering the following courses:')
     for c in courses:
@@ -44,9 +47,12 @@ def main():
     print('=========================================')
     print('Optimizing!')
     start = time.time()
-    result = co.optimize(courses)
+    stats = co.SearchStats()
+    result = co.optimize(courses, stats=stats)
     end = time.time()
     print('... complete! Optimization took', (end - start), 'seconds.')
+    print('Searched', stats.nodes, 'nodes,', stats.assignments_evaluated, 'complete assignments, and pruned',
+          sum(stats.prunes.values()), 'branches.')
     print('=========================================')
 
     if not result.possible:
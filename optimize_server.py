@@ -0,0 +1,388 @@
+import argparse
+import asyncio
+from collections import deque
+from http import HTTPStatus
+import json
+import multiprocessing
+import os
+import signal
+import sys
+import time
+
+import batch_optimize
+import course_optimizer as co
+import result_cache
+
+# Seconds a request may take if it doesn't ask for less, and the most it may ask for. The incremental engine stops at
+# the budget and returns the best assignment so far. A solve that is still running once the budget (plus the grace
+# period) is up gets its worker killed, and the request fails.
+DEFAULT_TIME_LIMIT = 10.
+MAX_TIME_LIMIT = 60.
+DEADLINE_GRACE = 1.
+# engines that take a time_limit option
+TIME_LIMIT_ENGINES = ('incremental',)
+MAX_BODY_BYTES = 1 << 20
+MAX_HEADER_LINES = 100
+# the latency percentiles are over this many of the most recent requests
+LATENCY_WINDOW = 10000
+
+
+def _warm_up(engine, rules_path):
+    # runs once in every worker process when it starts, so the first real request doesn't pay for the imports (scipy
+    # for the milp engine) or for loading the rules
+    co.optimize([], engine)
+    if rules_path is not None:
+        batch_optimize._rule_sets[rules_path] = co.load_rules(rules_path)
+
+
+def _worker_main(connection, engine, rules_path):
+    # Ctrl-C is for the server, which stops the workers itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _warm_up(engine, rules_path)
+    connection.send(None)
+    while True:
+        try:
+            task = connection.recv()
+        except EOFError:
+            return
+        try:
+            connection.send((True, batch_optimize._optimize_record(*task)))
+        except Exception as e:
+            connection.send((False, str(e)))
+
+
+async def _receive(connection):
+    # waits for the next message on a multiprocessing connection without blocking the event loop
+    loop = asyncio.get_running_loop()
+    fileno = connection.fileno()
+    readable = loop.create_future()
+    loop.add_reader(fileno, lambda: readable.done() or readable.set_result(None))
+    try:
+        await readable
+    finally:
+        loop.remove_reader(fileno)
+    return connection.recv()
+
+
+def _canonical_course_dict(data):
+    name, grade, credits, categories, is_lab, is_passfail = data
+    return {'name': name, 'grade': grade, 'credits': credits, 'categories': categories, 'lab': is_lab,
+            'passfail': is_passfail}
+
+
+class OptimizeService:
+    def __init__(self, workers=None, engine='incremental', rules_path=None, cache_path=None,
+                 time_limit=DEFAULT_TIME_LIMIT, max_time_limit=MAX_TIME_LIMIT):
+        if engine not in co.ENGINES:
+            raise ValueError('Unknown optimization engine: ' + str(engine))
+        self.workers = workers or os.cpu_count() or 1
+        self.engine = engine
+        self.rules_path = rules_path
+        self.cache_path = cache_path
+        self.time_limit = min(time_limit, max_time_limit)
+        self.max_time_limit = max_time_limit
+        # Every worker is a (process, connection) pair. A plain process pool can't stop a task once it runs, so the
+        # service keeps its own workers, and kills and replaces one whose solve runs past its budget.
+        self._processes = {}
+        self._idle = None
+        self._replacements = set()
+        self._closed = False
+        # the solves that are running or waiting for a worker, by key, so that identical requests can share them
+        self._in_flight = {}
+        self._waiting = 0
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self.requests = 0
+        self.active_requests = 0
+        self.solves = 0
+        self.coalesced = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.restarts = 0
+
+    async def start(self):
+        # all the workers start (and warm up) now instead of during the first requests
+        self._idle = asyncio.Queue()
+        for worker in await asyncio.gather(*[self._start_worker() for _ in range(self.workers)]):
+            self._idle.put_nowait(worker)
+
+    async def _start_worker(self):
+        connection, child_connection = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=_worker_main, args=(child_connection, self.engine, self.rules_path),
+                                          daemon=True)
+        process.start()
+        child_connection.close()
+        self._processes[connection] = process
+        # the worker says when it's warmed up
+        await _receive(connection)
+        return connection
+
+    def _stop_worker(self, connection):
+        process = self._processes.pop(connection, None)
+        if process is None:
+            return
+        connection.close()
+        process.terminate()
+        process.join()
+
+    async def _replace_worker(self, connection):
+        self.restarts += 1
+        self._stop_worker(connection)
+        if not self._closed:
+            self._idle.put_nowait(await self._start_worker())
+
+    def close(self):
+        self._closed = True
+        for task in self._replacements:
+            task.cancel()
+        for connection in list(self._processes):
+            self._stop_worker(connection)
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    def metrics(self):
+        latencies = sorted(self._latencies)
+        return {
+            'requests': self.requests,
+            'active_requests': self.active_requests,
+            'solves': self.solves,
+            'coalesced': self.coalesced,
+            'timeouts': self.timeouts,
+            'errors': self.errors,
+            'workers': self.workers,
+            # workers killed for running past their budget (or dying)
+            'restarts': self.restarts,
+            'in_flight': len(self._in_flight),
+            # solves waiting for a free worker
+            'queue_depth': self._waiting,
+            'latency_mean': sum(latencies) / len(latencies) if latencies else 0.,
+            'latency_p50': batch_optimize.percentile(latencies, 0.5),
+            'latency_p99': batch_optimize.percentile(latencies, 0.99),
+        }
+
+    async def _solve(self, record, engine, options, deadline):
+        # runs the record on the next free worker, and kills the worker if it isn't done by the deadline
+        self._waiting += 1
+        try:
+            connection = await asyncio.wait_for(self._idle.get(), deadline - time.perf_counter())
+        finally:
+            self._waiting -= 1
+        if 'time_limit' in options:
+            # the budget started with the request, so the search only gets what's left of it after the wait
+            options = dict(options, time_limit=max(0., deadline - DEADLINE_GRACE - time.perf_counter()))
+        try:
+            connection.send((record, engine, options, self.cache_path, self.rules_path))
+            succeeded, value = await asyncio.wait_for(_receive(connection), deadline - time.perf_counter())
+        except BaseException:
+            # stuck in a search or dead; a fresh worker is quicker than waiting
+            if not self._closed:
+                task = asyncio.ensure_future(self._replace_worker(connection))
+                self._replacements.add(task)
+                task.add_done_callback(self._replacements.discard)
+            raise
+        self._idle.put_nowait(connection)
+        if not succeeded:
+            raise RuntimeError(value)
+        return value
+
+    def _forget(self, key, task):
+        self._in_flight.pop(key, None)
+        # nobody might be waiting for the result any more, so don't let an exception go unretrieved
+        if not task.cancelled():
+            task.exception()
+
+    async def optimize(self, course_dicts, engine=None, time_limit=None):
+        # Returns the batch_optimize.result_to_dict of the best assignment, with the solve time in 'seconds' and
+        # whether the request shared the solve of an identical one in 'coalesced'. Raises ValueError for bad requests
+        # and asyncio.TimeoutError when the time budget runs out.
+        start = time.perf_counter()
+        self.requests += 1
+        self.active_requests += 1
+        try:
+            engine = engine or self.engine
+            if engine not in co.ENGINES:
+                raise ValueError('Unknown optimization engine: ' + str(engine))
+            budget = self.time_limit if time_limit is None else float(time_limit)
+            if not budget > 0.:
+                raise ValueError('Time limit must be positive')
+            budget = min(budget, self.max_time_limit)
+            options = dict(batch_optimize.ENGINE_OPTIONS.get(engine, {}))
+            if engine in TIME_LIMIT_ENGINES:
+                options['time_limit'] = budget
+            # parse the courses here, so that bad requests never reach a worker
+            courses = [batch_optimize.course_from_dict(data) for data in course_dicts]
+            # Identical transcripts (up to course order and duplicate categories, like in the result cache, but with
+            # the exact grades) with the same budget share one solve of the canonical transcript, so they also get the
+            # same result.
+            canonical, _ = result_cache.canonical_transcript(courses, grade_digits=None)
+            key = json.dumps([engine, budget, canonical])
+
+            task = self._in_flight.get(key)
+            coalesced = task is not None
+            if coalesced:
+                self.coalesced += 1
+            else:
+                self.solves += 1
+                record = (None, [_canonical_course_dict(data) for data in canonical])
+                task = asyncio.ensure_future(self._solve(record, engine, options, start + budget + DEADLINE_GRACE))
+                self._in_flight[key] = task
+                task.add_done_callback(lambda done: self._forget(key, done))
+            try:
+                # shielded, so that a request that goes away doesn't cancel the solve for the others
+                data = await asyncio.wait_for(asyncio.shield(task), start + budget + DEADLINE_GRACE -
+                                              time.perf_counter())
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                raise
+            if 'error' in data:
+                raise ValueError(data['error'])
+            data = dict(data)
+            del data['student']
+            data['coalesced'] = coalesced
+            return data
+        finally:
+            self.active_requests -= 1
+            self._latencies.append(time.perf_counter() - start)
+
+    async def _respond(self, method, path, body):
+        if path == '/health':
+            if method != 'GET':
+                return HTTPStatus.METHOD_NOT_ALLOWED, {'error': 'Use GET'}
+            return HTTPStatus.OK, {'status': 'ok', 'workers': self.workers}
+        if path == '/metrics':
+            if method != 'GET':
+                return HTTPStatus.METHOD_NOT_ALLOWED, {'error': 'Use GET'}
+            return HTTPStatus.OK, self.metrics()
+        if path != '/optimize':
+            return HTTPStatus.NOT_FOUND, {'error': 'Unknown path ' + path}
+        if method != 'POST':
+            return HTTPStatus.METHOD_NOT_ALLOWED, {'error': 'Use POST'}
+        # {"courses": [...], "engine": ..., "time_limit": ...}, with the courses like in batch_optimize
+        try:
+            request = json.loads(body)
+            if not isinstance(request, dict) or not isinstance(request.get('courses'), list):
+                raise ValueError('The request needs a list of courses')
+            return HTTPStatus.OK, await self.optimize(request['courses'], request.get('engine'),
+                                                      request.get('time_limit'))
+        except (ValueError, TypeError, KeyError) as e:
+            return HTTPStatus.BAD_REQUEST, {'error': str(e)}
+        except asyncio.TimeoutError:
+            return HTTPStatus.GATEWAY_TIMEOUT, {'error': 'The time budget ran out'}
+        except Exception as e:
+            self.errors += 1
+            return HTTPStatus.INTERNAL_SERVER_ERROR, {'error': str(e)}
+
+    async def handle_connection(self, reader, writer):
+        # HTTP/1.1 with keep-alive, one request at a time per connection
+        try:
+            while True:
+                try:
+                    request = await _read_request(reader)
+                except ValueError as e:
+                    await _write_response(writer, HTTPStatus.BAD_REQUEST, {'error': str(e)}, False)
+                    break
+                if request is None:
+                    break
+                method, path, headers, body = request
+                status, data = await self._respond(method, path, body)
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                await _write_response(writer, status, data, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except asyncio.CancelledError:
+            # the server is shutting down with the connection still open
+            pass
+        finally:
+            writer.close()
+
+    async def serve_tcp(self, host='127.0.0.1', port=0):
+        return await asyncio.start_server(self.handle_connection, host, port)
+
+    async def serve_unix(self, path):
+        return await asyncio.start_unix_server(self.handle_connection, path)
+
+
+async def _read_request(reader):
+    # (method, path, headers, body), or None if the client closed the connection
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    parts = request_line.decode('latin-1').split()
+    if len(parts) != 3:
+        raise ValueError('Malformed request line')
+    method, path, _ = parts
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if not line:
+            raise asyncio.IncompleteReadError(line, None)
+        if line in (b'\r\n', b'\n'):
+            break
+        if len(headers) >= MAX_HEADER_LINES:
+            raise ValueError('Too many headers')
+        name, separator, value = line.decode('latin-1').partition(':')
+        if not separator:
+            raise ValueError('Malformed header')
+        headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get('content-length', 0))
+    except ValueError:
+        raise ValueError('Malformed Content-Length')
+    if not 0 <= length <= MAX_BODY_BYTES:
+        raise ValueError('Request body too large')
+    body = await reader.readexactly(length)
+    return method, path.split('?')[0], headers, body
+
+
+async def _write_response(writer, status, data, keep_alive):
+    body = json.dumps(data).encode()
+    head = ('HTTP/1.1 ' + str(status.value) + ' ' + status.phrase + '\r\n' +
+            'Content-Type: application/json\r\n' +
+            'Content-Length: ' + str(len(body)) + '\r\n' +
+            'Connection: ' + ('keep-alive' if keep_alive else 'close') + '\r\n\r\n')
+    writer.write(head.encode('latin-1') + body)
+    await writer.drain()
+
+
+async def serve(args):
+    async with OptimizeService(args.workers, args.engine, args.rules, args.cache, args.time_limit,
+                               args.max_time_limit) as service:
+        if args.unix is not None:
+            server = await service.serve_unix(args.unix)
+            address = args.unix
+        else:
+            server = await service.serve_tcp(args.host, args.port)
+            address = ':'.join(str(part) for part in server.sockets[0].getsockname()[:2])
+        print('Serving on', address, 'with', service.workers, 'workers.', file=sys.stderr)
+        async with server:
+            await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve course assignment optimizations over local HTTP.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--unix', help='listen on this Unix socket instead of TCP')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--engine', default='incremental', choices=sorted(co.ENGINES),
+                        help='engine for requests that don\'t name one')
+    parser.add_argument('--time-limit', type=float, default=DEFAULT_TIME_LIMIT,
+                        help='seconds per request, for requests that don\'t ask for less')
+    parser.add_argument('--max-time-limit', type=float, default=MAX_TIME_LIMIT)
+    parser.add_argument('--cache', help='SQLite file to cache results in')
+    parser.add_argument('--rules', help='JSON file with the degree rules (default: the built-in ones)')
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
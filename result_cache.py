@@ -0,0 +1,172 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+import course_optimizer as co
+
+# grades are rounded to this many digits before they go into the cache key, so that the same transcript typed in
+# slightly differently still hits
+GRADE_DIGITS = 2
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+def rules_version(rules=None):
+    # Changes whenever the credit minimums, the grade weights or what counts towards what changes, so results computed
+    # under other rules are never used.
+    config = (rules or co.DEFAULT_RULES).as_dict()
+    del config['name']
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def canonical_course(course, grade_digits=GRADE_DIGITS):
+    grade = round(course.grade, grade_digits) if course.grade is not None and grade_digits is not None else \
+        course.grade
+    categories = sorted(set(course.categories), key=lambda category: category.value)
+    return [str(course), grade, course.credits, [category.name for category in categories], bool(course._is_lab),
+            bool(course._is_passfail)]
+
+
+def canonical_transcript(courses, grade_digits=GRADE_DIGITS):
+    # Returns the canonical form of the courses (sorted, with deduplicated and sorted categories and grades rounded to
+    # grade_digits, or not at all if that's None), and for each canonical position the index of the course it came
+    # from.
+    canonical = [canonical_course(course, grade_digits) for course in courses]
+    order = sorted(range(len(courses)), key=lambda index: json.dumps(canonical[index]))
+    return [canonical[index] for index in order], order
+
+
+def _result_to_json(result, positions):
+    # positions maps the Course objects in the result to their canonical positions
+    data = {'possible': result.possible, 'max_grade': result.max_grade, 'worst_grade': result.worst_grade,
+            'pruned_nodes': result.pruned_nodes, 'optimal': result.optimal}
+    if result.assignments is not None:
+        data['assignments'] = {category.name: [positions[id(course)] for course in assigned]
+                               for category, assigned in result.assignments.items()}
+    if result.top_results is not None:
+        data['top_results'] = [_result_to_json(top_result, positions) for top_result in result.top_results]
+    return data
+
+
+def _result_from_json(data, courses):
+    # courses are the caller's courses in canonical order, as (input position, course)
+    assignments = None
+    if 'assignments' in data:
+        assignments = {category: [] for category in co.Category}
+        for name, assigned in data['assignments'].items():
+            # keep the courses in the order the caller gave them in
+            assignments[co.Category[name]] = [course for _, course in sorted(
+                (courses[position] for position in assigned), key=lambda entry: entry[0])]
+    result = co.OptimizationResult(data['possible'], data['max_grade'], assignments, data['worst_grade'],
+                                   data['pruned_nodes'])
+    result.optimal = data['optimal']
+    if 'top_results' in data:
+        result.top_results = [_result_from_json(top_data, courses) for top_data in data['top_results']]
+    return result
+
+
+def _regrade(result, rules):
+    # the grades of a result for a transcript whose grades only agree with the searched one after rounding
+    if result.possible:
+        result.max_grade = rules.grade(result.assignments)
+    if result.top_results is not None:
+        for top_result in result.top_results:
+            _regrade(top_result, rules)
+        result.top_results.sort(key=lambda top_result: -top_result.max_grade)
+
+
+class ResultCache:
+    # Puts an SQLite file in front of co.optimize(). Results are stored by a hash of the canonical transcript, the
+    # engine and its options, and the rules version, so results of several rule sets can share a file. Once the stored
+    # results take up more than max_bytes, the least recently used ones go.
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES):
+        self._max_bytes = max_bytes
+        # the version of each rule set used so far
+        self._versions = {}
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, timeout=30.)
+        with self._connection:
+            self._connection.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT, '
+                                     'size INTEGER, last_used REAL)')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)')
+        self.hits = 0
+        self.misses = 0
+        self.lookup_seconds = 0.
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.
+
+    @property
+    def mean_lookup_seconds(self):
+        lookups = self.hits + self.misses
+        return self.lookup_seconds / lookups if lookups else 0.
+
+    def as_dict(self):
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hit_rate,
+                'mean_lookup_seconds': self.mean_lookup_seconds}
+
+    def optimize(self, courses, engine='incremental', rules=None, **options):
+        try:
+            options_key = json.dumps(options, sort_keys=True)
+        except TypeError:
+            # things like SearchStats can't be part of a key, and their results aren't worth caching anyway
+            return co.optimize(courses, engine=engine, rules=rules, **options)
+        rules = rules or co.DEFAULT_RULES
+        version = self._versions.get(rules)
+        if version is None:
+            version = self._versions[rules] = rules_version(rules)
+        canonical, order = canonical_transcript(courses)
+        key = hashlib.sha256(json.dumps([version, engine, options_key, canonical]).encode()).hexdigest()
+        # (input position, course) for each canonical position
+        ordered_courses = [(index, courses[index]) for index in order]
+        grades = [course.grade for _, course in ordered_courses]
+
+        start = time.perf_counter()
+        with self._lock:
+            row = self._connection.execute('SELECT value FROM results WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                with self._connection:
+                    self._connection.execute('UPDATE results SET last_used = ? WHERE key = ?', (time.time(), key))
+        self.lookup_seconds += time.perf_counter() - start
+        if row is not None:
+            self.hits += 1
+            value = json.loads(row[0])
+            result = _result_from_json(value, ordered_courses)
+            # the stored assignments work for every transcript with the key, but the grades are the searched one's
+            if value.get('grades') != grades:
+                _regrade(result, rules)
+            return result
+        self.misses += 1
+
+        # search the caller's courses in canonical order, so that transcripts that share the key break ties alike
+        searched = [course for _, course in ordered_courses]
+        result = co.optimize(searched, engine=engine, rules=rules, **options)
+        value = _result_to_json(result, {id(course): position for position, course in enumerate(searched)})
+        value['grades'] = grades
+        # a search that ran out of time might do better next time
+        if result.optimal:
+            self._store(key, json.dumps(value))
+        return _result_from_json(value, ordered_courses)
+
+    def _store(self, key, value):
+        with self._lock, self._connection:
+            self._connection.execute('INSERT OR REPLACE INTO results (key, value, size, last_used) VALUES (?, ?, ?, ?)',
+                                     (key, value, len(value), time.time()))
+            total = self._connection.execute('SELECT SUM(size) FROM results').fetchone()[0]
+            while total > self._max_bytes:
+                key, size = self._connection.execute(
+                    'SELECT key, size FROM results ORDER BY last_used LIMIT 1').fetchone()
+                self._connection.execute('DELETE FROM results WHERE key = ?', (key,))
+                total -= size
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
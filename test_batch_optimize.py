@@ -0,0 +1,127 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+
+import batch_optimize
+from benchmark import synthetic_transcript
+import course_optimizer as co
+from test_course_optimizer import create_minimal_course_list, create_random_course_list, create_relaxed_rules
+
+
+def create_jsonl(course_lists):
+    return ''.join(json.dumps({'student': 'student ' + str(i),
+                               'courses': [batch_optimize.course_to_dict(course) for course in courses]}) + '\n'
+                   for i, courses in enumerate(course_lists))
+
+
+class BatchOptimizeTests(unittest.TestCase):
+    def testCourseRoundTrip(self):
+        for course in create_random_course_list(1, num_extra_courses=10):
+            parsed = batch_optimize.course_from_dict(batch_optimize.course_to_dict(course))
+            self.assertEqual(batch_optimize.course_to_dict(parsed), batch_optimize.course_to_dict(course))
+        with self.assertRaises(ValueError):
+            batch_optimize.course_from_dict({'name': 'x', 'grade': 4.0, 'credits': 2, 'categories': ['NOPE']})
+        with self.assertRaises(ValueError):
+            batch_optimize.course_from_dict({'name': 'x', 'credits': 2, 'categories': ['ELECTIVE']})
+
+    def testStreamKeepsInputOrder(self):
+        course_lists = [create_random_course_list(seed) for seed in range(6)]
+        records = list(batch_optimize.read_jsonl(io.StringIO(create_jsonl(course_lists))))
+        for workers in (1, 2):
+            results = list(batch_optimize.optimize_stream(iter(records), workers=workers))
+            self.assertEqual([data['student'] for data in results], ['student ' + str(i) for i in range(6)])
+            for data, courses in zip(results, course_lists):
+                expected = co.optimize(courses)
+                self.assertEqual(data['possible'], expected.possible)
+                self.assertEqual(data['max_grade'], expected.max_grade)
+                self.assertGreaterEqual(data['seconds'], 0.)
+
+    def testCsvInput(self):
+        lines = ['student,name,grade,credits,categories,lab,passfail\n']
+        for i, courses in enumerate([create_minimal_course_list(), create_minimal_course_list(4.0)]):
+            for course in courses:
+                lines.append(','.join(['s' + str(i), '"' + str(course) + '"', str(course.grade), str(course.credits),
+                                       ';'.join(category.name for category in course.categories), 'false',
+                                       'false']) + '\n')
+        records = list(batch_optimize.read_csv(io.StringIO(''.join(lines))))
+        self.assertEqual([student for student, _ in records], ['s0', 's1'])
+        results = list(batch_optimize.optimize_stream(iter(records)))
+        self.assertAlmostEqual(results[0]['max_grade'], 5.0)
+        self.assertAlmostEqual(results[1]['max_grade'], 4.0)
+        self.assertEqual(results[0]['assignments']['THESIS'], ["Buzzing and Fizzing: What's next?"])
+        with self.assertRaises(ValueError):
+            list(batch_optimize.read_csv(io.StringIO('student,name\n')))
+        # a short or long row only fails its own student
+        bad_lines = lines[:2] + ['s2,B,5.0\n', 's3,C,5.0,4,ELECTIVE,false,false,extra\n'] + lines[2:]
+        records = list(batch_optimize.read_csv(io.StringIO(''.join(bad_lines))))
+        self.assertEqual([student for student, _ in records], ['s0', 's2', 's3', 's0', 's1'])
+        results = list(batch_optimize.optimize_stream(iter(records)))
+        self.assertEqual(['error' in data for data in results], [False, True, True, False, False])
+        self.assertAlmostEqual(results[-1]['max_grade'], 4.0)
+
+    def testMain(self):
+        with tempfile.TemporaryDirectory() as directory:
+            input_path = os.path.join(directory, 'input.jsonl')
+            output_path = os.path.join(directory, 'output.jsonl')
+            with open(input_path, 'w') as input_file:
+                input_file.write(create_jsonl([create_minimal_course_list(), [], synthetic_transcript(2, 30)]))
+            # in input order, the incremental search wouldn't finish the synthetic transcript within the time limit
+            batch_optimize.main([input_path, '-o', output_path, '--workers', '1', '--time-limit', '5'])
+            with open(output_path) as output_file:
+                results = [json.loads(line) for line in output_file]
+        self.assertEqual([data['possible'] for data in results], [True, False, True])
+        self.assertTrue(results[2]['optimal'])
+
+    def testBadRecords(self):
+        lines = create_jsonl([create_minimal_course_list()] * 3).splitlines(True)
+        bad_course = batch_optimize.course_to_dict(create_minimal_course_list()[0])
+        bad_course['categories'] = ['NOPE']
+        # categories as a string instead of a list
+        string_course = dict(bad_course, categories='ELECTIVE')
+        lines[1:1] = [json.dumps({'student': 'bad', 'courses': [bad_course]}) + '\n',
+                      json.dumps({'student': 'string', 'courses': [string_course]}) + '\n',
+                      json.dumps({'student': 'no courses'}) + '\n', '{not json\n']
+        for workers in (1, 2):
+            results = list(batch_optimize.optimize_stream(batch_optimize.read_jsonl(io.StringIO(''.join(lines))),
+                                                          workers=workers))
+            self.assertEqual([data['student'] for data in results],
+                             ['student 0', 'bad', 'string', 'no courses', 5, 'student 1', 'student 2'])
+            self.assertEqual(['error' in data for data in results], [False, True, True, True, True, False, False])
+            self.assertIn('NOPE', results[1]['error'])
+            self.assertIn('list of categories', results[2]['error'])
+            self.assertAlmostEqual(results[-1]['max_grade'], 5.0)
+        with tempfile.TemporaryDirectory() as directory:
+            input_path = os.path.join(directory, 'input.jsonl')
+            output_path = os.path.join(directory, 'output.jsonl')
+            with open(input_path, 'w') as input_file:
+                input_file.writelines(lines)
+            batch_optimize.main([input_path, '-o', output_path, '--workers', '1'])
+            with open(output_path) as output_file:
+                self.assertEqual(len(output_file.readlines()), 7)
+
+    def testCache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache_path = os.path.join(directory, 'cache.sqlite')
+            records = list(batch_optimize.read_jsonl(io.StringIO(create_jsonl([create_minimal_course_list()] * 3))))
+            results = list(batch_optimize.optimize_stream(iter(records), cache_path=cache_path))
+            batch_optimize._caches.pop(cache_path).close()
+        self.assertEqual([data['cached'] for data in results], [False, True, True])
+        self.assertEqual(len(set(data['max_grade'] for data in results)), 1)
+
+    def testRules(self):
+        with tempfile.TemporaryDirectory() as directory:
+            rules_path = os.path.join(directory, 'rules.json')
+            with open(rules_path, 'w') as rules_file:
+                json.dump(create_relaxed_rules().as_dict(), rules_file)
+            # no thesis, which is fine under the relaxed rules
+            records = list(batch_optimize.read_jsonl(io.StringIO(create_jsonl([create_minimal_course_list()[:-1]]))))
+            for workers in (1, 2):
+                results = list(batch_optimize.optimize_stream(iter(records), workers=workers, rules_path=rules_path))
+                self.assertTrue(results[0]['possible'])
+            self.assertFalse(list(batch_optimize.optimize_stream(iter(records)))[0]['possible'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+
+import benchmark
+import course_optimizer as co
+
+
+class BenchmarkTests(unittest.TestCase):
+    def testRandomTranscript(self):
+        courses = benchmark.random_transcript(3, 12)
+        self.assertEqual(len(courses), 12)
+        self.assertEqual([str(course) for course in courses],
+                         [str(course) for course in benchmark.random_transcript(3, 12)])
+
+    def testOrderingBenchmark(self):
+        rows = benchmark.ordering_benchmark(sizes=(12,), seeds=2)
+        self.assertEqual([row['transcripts'] for row in rows], ['sample', '12 courses'])
+        for row in rows:
+            self.assertGreater(row['input_order']['nodes'], 0)
+            self.assertGreater(row['heuristic_order']['nodes'], 0)
+
+    def testSyntheticTranscript(self):
+        for seed in range(5):
+            for size in (10, 16):
+                feasible = benchmark.synthetic_transcript(seed, size)
+                self.assertEqual(len(feasible), size)
+                self.assertTrue(co.optimize(feasible).possible)
+                self.assertFalse(co.optimize(benchmark.synthetic_transcript(seed, size, feasible=False)).possible)
+        with self.assertRaises(ValueError):
+            benchmark.synthetic_transcript(0, 5)
+
+    def testEngineBenchmark(self):
+        configurations = [('dfs', 'dfs', {}), ('incremental-heuristic', 'incremental', {'heuristic_order': True})]
+        rows = benchmark.engine_benchmark(sizes=(10, 12), seeds=1, configurations=configurations)
+        self.assertEqual(len(rows), 8)
+        for row in rows:
+            self.assertEqual(row['status'], 'ok')
+            self.assertEqual(row['possible'], row['feasible'])
+            self.assertGreater(row['peak_bytes'], 0)
+            self.assertEqual(row['nodes'] is None, row['engine'] == 'dfs')
+        report = benchmark.benchmark_report(rows)
+        self.assertEqual(report['disagreements'], [])
+        self.assertEqual([(entry['engine'], entry['courses'], entry['finished']) for entry in report['summary']],
+                         [('dfs', 10, 2), ('dfs', 12, 2), ('incremental-heuristic', 10, 2),
+                          ('incremental-heuristic', 12, 2)])
+        self.assertEqual(benchmark.compare_reports(report, report), [])
+
+    def testTimeouts(self):
+        rows = benchmark.engine_benchmark(sizes=(30, 40), seeds=1, configurations=[('dfs', 'dfs', {})],
+                                          max_seconds=0.5, measure_memory=False)
+        self.assertEqual(rows[0]['status'], 'timeout')
+        self.assertEqual({row['status'] for row in rows[1:]}, {'skipped'})
+        self.assertEqual(benchmark.summarize(rows)[0]['finished'], 0)
+
+    def testCompareReports(self):
+        old = {'summary': [{'engine': 'dfs', 'courses': 10, 'finished': 2, 'median_seconds': 1.},
+                           {'engine': 'dfs', 'courses': 20, 'finished': 2, 'median_seconds': 1.}]}
+        new = {'summary': [{'engine': 'dfs', 'courses': 10, 'finished': 2, 'median_seconds': 2.},
+                           {'engine': 'dfs', 'courses': 20, 'finished': 0, 'median_seconds': None}]}
+        self.assertEqual([(regression['courses'], regression['what']) for regression in
+                          benchmark.compare_reports(old, new)], [(10, 'median seconds'), (20, 'finished cases')])
+        self.assertEqual(benchmark.compare_reports(new, old), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,14 @@
+from concurrent.futures import ThreadPoolExecutor
+import copy
+import json
+import os
+import pickle
+import random
+import tempfile
+import time
 import unittest
 
+import benchmark
 import course_optimizer as co
 
 
@@ -19,6 +28,74 @@ def create_minimal_course_list(default_grade=5.0):
     return courses
 
 
+def create_random_course_list(seed, num_extra_courses=5):
+    rng = random.Random(seed)
+    courses = create_minimal_course_list(rng.choice([4.0, 4.5, 5.0]))
+    category_options = [
+        [co.Category.CORE_FOCUS, co.Category.ELECTIVE_CS, co.Category.ELECTIVE],
+        [co.Category.ELECTIVE_FOCUS, co.Category.ELECTIVE_CS, co.Category.ELECTIVE],
+        [co.Category.SEMINAR_IN_FOCUS],
+        [co.Category.ELECTIVE_CS, co.Category.ELECTIVE],
+        [co.Category.INTERFOCUS],
+        [co.Category.ELECTIVE],
+        [co.Category.SCIENCE_IN_PERSPECTIVE],
+    ]
+    for i in range(num_extra_courses):
+        course = co.Course("Extra " + str(i), rng.choice([3.5, 4.0, 4.25, 4.75, 5.0, 5.5, 6.0]),
+                           rng.choice([2, 4, 5, 6, 8, 10]), *rng.choice(category_options))
+        course.lab(rng.random() < 0.2)
+        if rng.random() < 0.1:
+            course.passfail(True)
+        courses.append(course)
+    # drop a few of the minimal courses so that some lists are infeasible
+    for _ in range(rng.randint(0, 2)):
+        courses.pop(rng.randrange(len(courses)))
+    rng.shuffle(courses)
+    return courses
+
+
+def assert_same_best(test_case, result, expected, rules=None):
+    # Engines may break ties differently, so they only have to agree on whether there is a solution and on the best
+    # grade, and that has to be the grade of the assignment they return.
+    test_case.assertEqual(result.possible, expected.possible)
+    if expected.possible:
+        test_case.assertAlmostEqual(result.max_grade, expected.max_grade)
+        test_case.assertAlmostEqual(co.compute_grade(result.assignments, rules), expected.max_grade)
+
+
+def grade_signature(assignments):
+    # the graded courses in each grade group, and the labs wherever they are
+    return frozenset((str(course), co.DEFAULT_RULES.category_groups[category])
+                     for category, assigned in assignments.items() for course in assigned
+                     if (co.DEFAULT_RULES.category_groups[category] is not None and not course._is_passfail)
+                     or course._is_lab)
+
+
+def create_relaxed_rules():
+    # the default rules without the thesis (and its 30 credits), and with elective CS courses weighted like the focus
+    # ones
+    config = copy.deepcopy(co.DEFAULT_RULES_CONFIG)
+    config['name'] = 'relaxed'
+    config['counters'] = [counter for counter in config['counters'] if counter['name'] != 'thesis']
+    config['counters'][0]['min_credits'] = 60
+    config['categories']['THESIS'] = ['total']
+    config['grade_groups'] = [group for group in config['grade_groups'] if group['categories'] != ['THESIS']]
+    config['grade_groups'][2]['weight'] = 3.
+    return co.RuleSet(config)
+
+
+def installed_engines():
+    # engines whose optional dependencies are missing raise ImportError when used
+    engines = []
+    for engine in co.ENGINES:
+        try:
+            co.optimize([], engine=engine)
+        except ImportError:
+            continue
+        engines.append(engine)
+    return engines
+
+
 class OptimizerTests(unittest.TestCase):
     def testTrivialSolutions(self):
         courses = create_minimal_course_list(4.0)
@@ -163,6 +240,362 @@ class OptimizerTests(unittest.TestCase):
         result = co.optimize(courses)
         self.assertFalse(result.possible)
 
+    def testSkippedLabDoesNotBlockLaterLab(self):
+        default_grade = 4.0
+        courses = [
+            co.Course("CF", default_grade, 24, co.Category.CORE_FOCUS, co.Category.ELECTIVE, co.Category.ELECTIVE_CS,
+                      co.Category.ELECTIVE),
+            co.Course("SF", default_grade, 2, co.Category.SEMINAR_IN_FOCUS),
+            co.Course("Bad lab", 3.0, 10, co.Category.ELECTIVE_CS, co.Category.ELECTIVE).lab(True),
+            co.Course("Good lab", 6.0, 10, co.Category.ELECTIVE_CS, co.Category.ELECTIVE).lab(True),
+            co.Course("IF", default_grade, 12, co.Category.INTERFOCUS),
+            co.Course("EL", default_grade, 10, co.Category.ELECTIVE),
+            co.Course("SIP", default_grade, 2, co.Category.SCIENCE_IN_PERSPECTIVE),
+            co.Course("MT", default_grade, 30, co.Category.THESIS),
+        ]
+        for engine in installed_engines():
+            result = co.optimize(courses, engine=engine)
+            self.assertTrue(result.possible)
+            self.assertAlmostEqual(result.max_grade, (3 * 4 + 4 + 6 + 2 * 4) / 7)
+
+    def testEnginesAgree(self):
+        engines = installed_engines()
+        for seed in range(20):
+            courses = create_random_course_list(seed)
+            expected = co.optimize_dfs(courses)
+            for engine in engines:
+                assert_same_best(self, co.optimize(courses, engine=engine), expected)
+
+    def testIncrementalMatchesExhaustiveAssignments(self):
+        for seed in range(20):
+            courses = create_random_course_list(seed)
+            expected = co.optimize_dfs(courses)
+            result = co.optimize_incremental(courses)
+            self.assertEqual(result.possible, expected.possible)
+            if expected.possible:
+                self.assertEqual(result.max_grade, expected.max_grade)
+                self.assertEqual(result.assignments, expected.assignments)
+
+    def testGradeUpperBoundIsAdmissible(self):
+        pruned_nodes = 0
+        for seed in range(20):
+            courses = create_random_course_list(seed)
+            result = co.optimize(courses)
+            pruned_nodes += result.pruned_nodes
+            if result.possible:
+                self.assertGreaterEqual(co.SearchState(courses).grade_upper_bound(0) + co.GRADE_TOLERANCE,
+                                        result.max_grade)
+        self.assertGreater(pruned_nodes, 0)
+
+    def testUndominatedOptions(self):
+        course = co.Course("CF", 5.0, 6, co.Category.CORE_FOCUS, co.Category.ELECTIVE_FOCUS, co.Category.ELECTIVE,
+                           co.Category.ELECTIVE_CS, co.Category.ELECTIVE)
+        self.assertEqual(co.undominated_options(course),
+                         [co.Category.CORE_FOCUS, co.Category.ELECTIVE, co.Category.ELECTIVE_CS])
+        # leaving out a lab keeps the lab slot free
+        course.lab(True)
+        self.assertEqual(co.undominated_options(course),
+                         [co.Category.CORE_FOCUS, co.Category.ELECTIVE, co.Category.ELECTIVE_CS, None])
+        self.assertEqual(co.undominated_options(co.Course("Nothing", 5.0, 6)), [None])
+
+    def testCompiledCourses(self):
+        course = co.Course("Intro to FizzBuzz", 5.0, 6, co.Category.ELECTIVE, co.Category.INTERFOCUS,
+                           co.Category.ELECTIVE).passfail(True)
+        compiled = co.compile_courses([co.Course("Other", 4.0, 3), course])
+        self.assertIs(co.compile_courses(compiled), compiled)
+        self.assertIs(compiled[1].course, course)
+        self.assertEqual(compiled[1].index, 1)
+        self.assertEqual(compiled[1].categories, (co.Category.ELECTIVE, co.Category.INTERFOCUS))
+        self.assertEqual(compiled[1].category_mask,
+                         1 << co.Category.ELECTIVE.value | 1 << co.Category.INTERFOCUS.value)
+        self.assertTrue(compiled[1]._is_passfail)
+        self.assertEqual(compiled[1].groups, {1})
+        # engines hand back the original courses
+        result = co.optimize(create_minimal_course_list())
+        for assigned in result.assignments.values():
+            for assigned_course in assigned:
+                self.assertIsInstance(assigned_course, co.Course)
+
+    def testCreditCounts(self):
+        counts = co.CreditCounts()
+        for category in co.Category:
+            counts.add_assigned_course(category, 2)
+        self.assertEqual(counts.values(), (16, 8, 6, 2, 2, 2, 2, 2, 2))
+        self.assertEqual(str(counts), 'counts: [16, 8, 6, 2, 2, 2, 2, 2, 2]')
+        counts.remove_assigned_course(co.Category.CORE_FOCUS, 2)
+        self.assertEqual((counts + counts.copy()).values(), (28, 12, 8, 0, 4, 4, 4, 4, 4))
+        # core focus has to be strictly above the minimum
+        self.assertFalse(co.CreditCounts(core_focus=10).all_greater_than_or_equal(co.CreditCounts(core_focus=10)))
+        self.assertTrue(co.CreditCounts(core_focus=11).all_greater_than_or_equal(co.CreditCounts(core_focus=10)))
+
+    def testParetoMatchesIncremental(self):
+        for seed in range(5):
+            courses = create_random_course_list(seed, num_extra_courses=10)
+            assert_same_best(self, co.optimize(courses, engine='pareto'), co.optimize(courses))
+
+    def testMemoizedSearch(self):
+        memo_hits = 0
+        memo_misses = 0
+        for seed in range(20):
+            courses = create_random_course_list(seed)
+            expected = co.optimize(courses)
+            # a tiny memo table keeps evicting entries, which must not change the result
+            for memo_size in [10, 100000]:
+                result = co.optimize(courses, memo_size=memo_size)
+                assert_same_best(self, result, expected)
+                # the memo only prunes, so it never searches more than the plain search
+                self.assertLessEqual(result.pruned_nodes - result.memo_hits, expected.pruned_nodes)
+                memo_hits += result.memo_hits
+                memo_misses += result.memo_misses
+        # (when the greedy assignment is already optimal, the search might not get far enough to look anything up)
+        self.assertGreater(memo_hits, 0)
+        self.assertGreater(memo_misses, 0)
+
+    def testParallelMatchesSerialAssignments(self):
+        for seed in range(10):
+            courses = create_random_course_list(seed)
+            expected = co.optimize(courses)
+            result = co.optimize(courses, engine='parallel', workers=2, split_depth=3)
+            self.assertEqual(result.possible, expected.possible)
+            self.assertEqual(result.max_grade, expected.max_grade)
+            self.assertEqual(result.assignments, expected.assignments)
+
+    def testParallelMeasuresSpeedup(self):
+        result = co.optimize(create_random_course_list(0), engine='parallel', workers=2, measure_speedup=True)
+        self.assertGreater(result.speedup, 0.)
+        self.assertIsNone(co.optimize(create_random_course_list(0)).speedup)
+
+    def testSearchStats(self):
+        for seed in range(10):
+            courses = create_random_course_list(seed)
+            reported = []
+            stats = co.SearchStats(callback=lambda current: reported.append(current.as_dict()), callback_interval=10)
+            result = co.optimize(courses, stats=stats)
+            expected = co.optimize(courses)
+            self.assertIs(result.stats, stats)
+            self.assertIsNone(expected.stats)
+            self.assertEqual(result.max_grade, expected.max_grade)
+            self.assertEqual(stats.prunes['bound'], result.pruned_nodes)
+            self.assertEqual(stats.nodes_per_depth[0], 1)
+            self.assertLessEqual(stats.max_depth, len(courses))
+            self.assertEqual(stats.assignments_evaluated > 0, result.possible)
+            self.assertEqual(len(reported), stats.nodes // 10 + 1)
+            self.assertTrue(reported[-1]['finished'])
+            self.assertEqual(reported[-1]['nodes'], stats.nodes)
+
+    def testAnytimeResults(self):
+        for seed in range(10):
+            courses = create_random_course_list(seed)
+            expected = co.optimize(courses)
+            results = list(co.optimize_anytime(courses))
+            final = results[-1]
+            self.assertTrue(final.optimal)
+            self.assertEqual(final.possible, expected.possible)
+            self.assertEqual(final.assignments, expected.assignments)
+            grades = [result.max_grade for result in results[:-1]]
+            self.assertEqual(grades, sorted(set(grades)))
+            for result in results[:-1]:
+                self.assertFalse(result.optimal)
+                self.assertAlmostEqual(result.max_grade, co.compute_grade(result.assignments))
+
+    def testGreedyAssignment(self):
+        courses = create_minimal_course_list()
+        grade, assignments = co.greedy_assignment(courses)
+        self.assertTrue(co.create_credit_counts_from_assignments(assignments).all_greater_than_or_equal(
+            co.MIN_CREDIT_COUNTS))
+        self.assertAlmostEqual(grade, co.compute_grade(assignments))
+        self.assertIsNone(co.greedy_assignment([]))
+
+    def testSearchBudgets(self):
+        courses = create_random_course_list(1, num_extra_courses=10)
+        expected = co.optimize(courses)
+        result = co.optimize(courses, node_limit=0)
+        self.assertFalse(result.optimal)
+        if result.possible:
+            self.assertLessEqual(result.max_grade, expected.max_grade + co.GRADE_TOLERANCE)
+        result = co.optimize(courses, node_limit=10 ** 9, time_limit=60.)
+        self.assertTrue(result.optimal)
+        self.assertEqual(result.assignments, expected.assignments)
+        result = co.optimize(courses, time_limit=0.)
+        self.assertEqual(result.possible, expected.possible)
+        with self.assertRaises(ValueError):
+            co.optimize(courses, memo_size=100, node_limit=10)
+
+    def testTopK(self):
+        for seed in range(10):
+            courses = create_random_course_list(seed)
+            expected = co.optimize(courses)
+            # nothing gets pruned for the top k while there are fewer than k assignments
+            everything = co.optimize(courses, top_k=10 ** 9)
+            result = co.optimize(courses, top_k=5)
+            self.assertEqual(result.possible, expected.possible)
+            if not expected.possible:
+                continue
+            self.assertEqual(result.assignments, expected.assignments)
+            self.assertEqual(result.top_results[0].assignments, result.assignments)
+            self.assertEqual(len(result.top_results), min(5, len(everything.top_results)))
+            for top_result, other in zip(result.top_results, everything.top_results):
+                self.assertAlmostEqual(top_result.max_grade, other.max_grade)
+                self.assertAlmostEqual(top_result.max_grade, co.compute_grade(top_result.assignments))
+            # the alternatives differ in more than where ungraded courses are listed
+            signatures = [grade_signature(top_result.assignments) for top_result in result.top_results]
+            self.assertEqual(len(set(signatures)), len(signatures))
+            self.assertGreaterEqual(result.pruned_nodes, everything.pruned_nodes)
+        self.assertIsNone(co.optimize(create_minimal_course_list()).top_results)
+        with self.assertRaises(ValueError):
+            co.optimize(create_minimal_course_list(), top_k=0)
+
+    def testHeuristicOrder(self):
+        for seed in range(10):
+            courses = create_random_course_list(seed, num_extra_courses=10)
+            expected = co.optimize(courses)
+            result = co.optimize(courses, heuristic_order=True, top_k=3)
+            assert_same_best(self, result, expected)
+            if not expected.possible:
+                continue
+            # the courses come back in the order they were given in
+            for top_result in result.top_results:
+                for assigned in top_result.assignments.values():
+                    self.assertEqual(assigned, sorted(assigned, key=courses.index))
+        ordered = co.order_courses(create_minimal_course_list())
+        self.assertEqual([course.index for course in ordered], list(range(len(ordered))))
+        self.assertEqual(str(ordered[0]), "Intro to FizzBuzz")
+
+    def testDeepCourseList(self):
+        # deeper than the default recursion limit
+        courses = [co.Course("Filler " + str(i), 4.0, 1, co.Category.ELECTIVE, co.Category.INTERFOCUS)
+                   for i in range(1200)] + create_minimal_course_list()
+        stats = co.SearchStats()
+        result = co.optimize(courses, stats=stats)
+        self.assertTrue(result.possible)
+        self.assertAlmostEqual(result.max_grade, 5.0)
+        self.assertEqual(stats.max_depth, len(courses))
+
+    def testConcurrentCalls(self):
+        course_lists = [create_random_course_list(seed) for seed in range(8)]
+        expected = [co.optimize_dfs(courses) for courses in course_lists]
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(co.optimize_dfs, course_lists * 2))
+            results += list(executor.map(co.optimize, course_lists))
+        for result, expected_result in zip(results, expected * 3):
+            self.assertEqual(result.possible, expected_result.possible)
+            self.assertEqual(result.assignments, expected_result.assignments)
+
+    def testOptimizerSession(self):
+        for seed in range(10):
+            courses = create_random_course_list(seed, num_extra_courses=8)
+            optimizer = co.Optimizer(courses[:-1])
+            optimizer.optimize()
+            edits = [
+                lambda: optimizer.add_course(courses[-1]),
+                lambda: optimizer.update_course(courses[0], co.Course("Updated", 6.0, courses[0].credits,
+                                                                      *courses[0].categories)),
+                lambda: optimizer.remove_course(courses[1]),
+                lambda: optimizer.add_course(co.Course("New", 3.5, 40, co.Category.ELECTIVE)),
+            ]
+            for edit in edits:
+                result = edit()
+                self.assertIs(result, optimizer.result)
+                assert_same_best(self, result, co.optimize(optimizer.courses))
+                if result.possible:
+                    for assigned in result.assignments.values():
+                        self.assertEqual(assigned, sorted(assigned, key=optimizer.courses.index))
+
+    def testOptimizerSessionKeepsAssignment(self):
+        courses = create_minimal_course_list()
+        optimizer = co.Optimizer(courses)
+        previous = optimizer.optimize().assignments
+        # a course that can't make anything better doesn't change the assignment
+        result = optimizer.add_course(co.Course("Same grade", 5.0, 4, co.Category.ELECTIVE_CS))
+        self.assertEqual(result.assignments, previous)
+        # and taking away one that isn't assigned doesn't even need a search
+        optimizer.add_course(co.Course("Bad", 1.0, 4, co.Category.INTERFOCUS))
+        result = optimizer.remove_course(optimizer.courses[-1])
+        self.assertEqual(optimizer.stats.nodes, 0)
+        self.assertEqual(result.assignments, previous)
+
+    def testOptimizerSessionBeatsColdSearch(self):
+        # an edit only searches what it could affect, so it has to be quicker than optimizing from scratch
+        courses = benchmark.synthetic_transcript(0, 30)
+        old_course = next(course for course in reversed(courses) if not course._is_passfail and course.grade < 6.)
+        new_course = co.Course("Retaken", old_course.grade + 0.5, old_course.credits, *old_course.categories)
+        optimizer = co.Optimizer(courses[:-1])
+        optimizer.optimize()
+        edits = [(lambda: optimizer.add_course(courses[-1]), courses),
+                 (lambda: optimizer.update_course(old_course, new_course),
+                  [new_course if course is old_course else course for course in courses])]
+        for edit, edited_courses in edits:
+            start = time.perf_counter()
+            result = edit()
+            edit_seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            expected = co.optimize(edited_courses, heuristic_order=True)
+            cold_seconds = time.perf_counter() - start
+            assert_same_best(self, result, expected)
+            self.assertLess(edit_seconds, cold_seconds)
+
+    def testUnknownEngine(self):
+        with self.assertRaises(ValueError):
+            co.optimize(create_minimal_course_list(), engine='magic')
+
+    def testDefaultRules(self):
+        rules = co.DEFAULT_RULES
+        self.assertEqual(rules.group_min_credits, (26, 12, 8, 30))
+        self.assertEqual(rules.min_credit_counts.values(), co.MIN_CREDIT_COUNTS.values())
+        self.assertEqual(rules.incidence[co.Category.ELECTIVE_CS], (1, 1, 0, 0, 0, 1, 0, 0, 0))
+        self.assertFalse(rules.satisfied(co.CreditCounts(90, 36, 26, 10, 2, 8, 12, 2, 30)))
+        self.assertTrue(rules.satisfied(co.CreditCounts(90, 36, 26, 11, 2, 8, 12, 2, 30)))
+        # the config round trips through a file, and compiles to the same tables
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'rules.json')
+            with open(path, 'w') as rules_file:
+                json.dump(rules.as_dict(), rules_file)
+            loaded = co.load_rules(path)
+        self.assertEqual(loaded.as_dict(), rules.as_dict())
+        self.assertEqual(pickle.loads(pickle.dumps(rules)).as_dict(), rules.as_dict())
+        for seed in range(5):
+            courses = create_random_course_list(seed)
+            assert_same_best(self, co.optimize(courses, rules=loaded), co.optimize(courses))
+
+    def testBadRules(self):
+        config = co.DEFAULT_RULES.as_dict()
+        for change in [lambda config: config['categories'].update(MAGIC=['total']),
+                       lambda config: config['categories'].update(ELECTIVE=['magic']),
+                       lambda config: config['grade_groups'][0]['categories'].append('THESIS'),
+                       lambda config: config['counters'].append({'name': 'total', 'min_credits': 1}),
+                       lambda config: [group.update(weight=0.) for group in config['grade_groups']],
+                       lambda config: config.pop('grade_groups'),
+                       lambda config: config['counters'][0].update(min_credits='10'),
+                       lambda config: config['counters'][0].update(min_credits=float('inf')),
+                       lambda config: config['counters'][0].update(min_credits=float('nan'))]:
+            bad_config = copy.deepcopy(config)
+            change(bad_config)
+            with self.assertRaises(ValueError):
+                co.RuleSet(bad_config)
+
+    def testOtherRules(self):
+        rules = create_relaxed_rules()
+        self.assertEqual(rules.group_min_credits, (26, 12, 8))
+        # without the thesis requirement, transcripts without one work
+        courses = [course for course in create_minimal_course_list() if course.categories != [co.Category.THESIS]]
+        self.assertFalse(co.optimize(courses).possible)
+        self.assertTrue(co.optimize(courses, rules=rules).possible)
+        for seed in range(8):
+            courses = create_random_course_list(seed, num_extra_courses=7)
+            expected = co.optimize_dfs(courses, rules=rules)
+            results = [co.optimize(courses, engine, rules=rules) for engine in ('incremental', 'pareto')]
+            results.append(co.optimize(courses, rules=rules, heuristic_order=True))
+            results.append(co.optimize(courses, rules=rules, memo_size=10000))
+            results.append(co.Optimizer(courses, rules).optimize())
+            results += co.optimize_rule_sets(courses, [rules, co.DEFAULT_RULES])
+            for result in results[:-1]:
+                assert_same_best(self, result, expected, rules)
+            assert_same_best(self, results[-1], co.optimize(courses))
+        # courses compiled for one rule set get compiled again for another
+        compiled = co.compile_courses(courses, rules)
+        self.assertIs(co.compile_courses(compiled), compiled)
+        self.assertIs(co.compile_courses(compiled, co.DEFAULT_RULES).rules, co.DEFAULT_RULES)
+
 
 def main():
     unittest.main()
@@ -0,0 +1,81 @@
+import time
+import unittest
+
+import benchmark
+import course_optimizer as co
+from test_course_optimizer import create_minimal_course_list, create_random_course_list
+
+try:
+    import grade_uncertainty
+except ImportError:
+    grade_uncertainty = None
+
+
+def with_grades(courses, grades):
+    return [co.Course(str(course), grades.get(course, course.grade), course.credits, *course.categories).lab(
+        course._is_lab).passfail(course._is_passfail) for course in courses]
+
+
+@unittest.skipIf(grade_uncertainty is None, 'numpy is not installed')
+class GradeUncertaintyTests(unittest.TestCase):
+    def testKnownGrades(self):
+        courses = create_minimal_course_list(4.5)
+        result = grade_uncertainty.analyze_grade_uncertainty(courses, {}, num_scenarios=10)
+        self.assertTrue(result.possible)
+        self.assertAlmostEqual(result.mean, co.optimize(courses).max_grade)
+        self.assertEqual(list(result.frequencies), [1.])
+        self.assertFalse(grade_uncertainty.analyze_grade_uncertainty([], {}, num_scenarios=10).possible)
+
+    def testMatchesOptimize(self):
+        for seed in range(10):
+            courses = create_random_course_list(seed)
+            graded = [course for course in courses if not course._is_passfail][:3]
+            # the columns of the scenarios go by the order of the courses, not of pending
+            pending = {graded[2]: (5.0, 5.0), graded[1]: {4.0: 1, 5.5: 3}, graded[0]: (3.0, 6.0)}
+            result = grade_uncertainty.analyze_grade_uncertainty(courses, pending, num_scenarios=200, seed=seed)
+            self.assertEqual(result.pending_courses, graded)
+            self.assertEqual(result.possible, co.optimize(courses).possible)
+            if not result.possible:
+                continue
+            self.assertAlmostEqual(sum(result.frequencies), 1.)
+            self.assertTrue(all(grade in (4.0, 5.5) for grade in result.scenarios[:, 1]))
+            self.assertTrue(all(grade == 5.0 for grade in result.scenarios[:, 2]))
+            for scenario in range(0, 200, 20):
+                grades = dict(zip(graded, result.scenarios[scenario]))
+                expected = co.optimize(with_grades(courses, grades))
+                self.assertAlmostEqual(result.scenario_grades[scenario], expected.max_grade)
+                # the reported assignment gets that grade, too
+                assignments = result.assignments[result.scenario_assignments[scenario]]
+                renamed = {course: new_course for course, new_course in zip(courses, with_grades(courses, grades))}
+                self.assertAlmostEqual(co.compute_grade({category: [renamed[course] for course in assigned]
+                                                         for category, assigned in assignments.items()}),
+                                       expected.max_grade)
+
+    def testLongTranscript(self):
+        # far too many assignments to enumerate, but only a few of them can be optimal
+        courses = benchmark.synthetic_transcript(1, 25)
+        graded = [course for course in courses if not course._is_passfail][:3]
+        pending = {graded[0]: (3.0, 6.0), graded[1]: {4.0: 1, 5.5: 3}, graded[2]: (4.5, 5.5)}
+        start = time.perf_counter()
+        result = grade_uncertainty.analyze_grade_uncertainty(courses, pending, seed=1)
+        self.assertLess(time.perf_counter() - start, 10.)
+        for scenario in [result.scenarios.argmin(axis=0)[0], result.scenarios.argmax(axis=0)[0]]:
+            grades = dict(zip(graded, result.scenarios[scenario]))
+            expected = co.optimize(with_grades(courses, grades), memo_size=10 ** 6)
+            self.assertAlmostEqual(result.scenario_grades[scenario], expected.max_grade)
+
+    def testBadDistributions(self):
+        courses = create_minimal_course_list(4.0)
+        with self.assertRaises(ValueError):
+            grade_uncertainty.analyze_grade_uncertainty(courses, {courses[0]: (5.0, 4.0)})
+        passfail = co.Course("Pass/fail", None, 10, co.Category.ELECTIVE).passfail(True)
+        with self.assertRaises(ValueError):
+            grade_uncertainty.analyze_grade_uncertainty(courses + [passfail], {passfail: (4.0, 6.0)})
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+import time
+import unittest
+
+from benchmark import synthetic_transcript
+import course_optimizer as co
+from test_course_optimizer import (assert_same_best, create_minimal_course_list, create_random_course_list,
+                                   create_relaxed_rules)
+
+try:
+    import milp_optimizer
+except ImportError:
+    milp_optimizer = None
+
+
+@unittest.skipIf(milp_optimizer is None, 'scipy is not installed')
+class MilpOptimizerTests(unittest.TestCase):
+    def assertSameAsDfs(self, courses):
+        assert_same_best(self, co.optimize(courses, engine='milp'), co.optimize(courses, engine='dfs'))
+
+    def testMinimalCourseLists(self):
+        for default_grade in [4.0, 5.0, 6.0]:
+            courses = create_minimal_course_list(default_grade)
+            self.assertSameAsDfs(courses)
+            # without any one of the courses there aren't enough credits
+            for i in range(len(courses)):
+                self.assertSameAsDfs(courses[:i] + courses[i + 1:])
+
+    def testBetterCourses(self):
+        courses = create_minimal_course_list(4.0)
+        better_courses = [
+            co.Course("Better core focus", 6.0, 24, co.Category.CORE_FOCUS, co.Category.ELECTIVE,
+                      co.Category.ELECTIVE_CS, co.Category.ELECTIVE),
+            co.Course("Better seminar", 6.0, 2, co.Category.SEMINAR_IN_FOCUS),
+            co.Course("Better elective", 6.0, 10, co.Category.ELECTIVE_CS, co.Category.ELECTIVE),
+            co.Course("Better interfocus", 6.0, 12, co.Category.INTERFOCUS),
+            co.Course("Better gess", 6.0, 2, co.Category.SCIENCE_IN_PERSPECTIVE),
+            co.Course("Lab", 6.0, 10, co.Category.ELECTIVE_CS, co.Category.ELECTIVE).lab(True),
+            co.Course("Pass/fail", None, 10, co.Category.ELECTIVE_CS, co.Category.ELECTIVE).passfail(True),
+        ]
+        for better_course in better_courses:
+            self.assertSameAsDfs(courses + [better_course])
+        self.assertSameAsDfs(courses + better_courses[:2])
+
+    def testRandomCourseLists(self):
+        for seed in range(20):
+            self.assertSameAsDfs(create_random_course_list(seed))
+
+    def testOtherRules(self):
+        rules = create_relaxed_rules()
+        for seed in range(10):
+            courses = create_random_course_list(seed)
+            result = co.optimize(courses, engine='milp', rules=rules)
+            assert_same_best(self, result, co.optimize(courses, rules=rules), rules)
+
+    def testLargeTranscript(self):
+        # 67 courses, which the incremental search can't finish, but the solve takes well under a second
+        courses = create_random_course_list(1, num_extra_courses=60)
+        start = time.perf_counter()
+        result = co.optimize(courses, engine='milp')
+        self.assertLess(time.perf_counter() - start, 2.)
+        self.assertTrue(result.possible)
+        self.assertAlmostEqual(result.max_grade, co.compute_grade(result.assignments))
+        self.assertGreaterEqual(co.SearchState(courses).grade_upper_bound(0) + co.GRADE_TOLERANCE, result.max_grade)
+        # at least as good as anything the incremental search finds in a while
+        best_found = co.optimize(courses, heuristic_order=True, node_limit=20000)
+        self.assertGreaterEqual(result.max_grade + co.GRADE_TOLERANCE, best_found.max_grade)
+
+    def testSyntheticTranscripts(self):
+        # each of these takes well under a second, and gets the same grade the (heuristic order) search proves optimal
+        for seed in range(4):
+            courses = synthetic_transcript(seed, 30)
+            start = time.perf_counter()
+            result = co.optimize(courses, engine='milp')
+            self.assertLess(time.perf_counter() - start, 2.)
+            expected = co.optimize(courses, heuristic_order=True)
+            self.assertAlmostEqual(result.max_grade, expected.max_grade)
+            self.assertAlmostEqual(result.max_grade, co.compute_grade(result.assignments))
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+import unittest
+
+import batch_optimize
+import benchmark
+import course_optimizer as co
+import optimize_server
+from test_course_optimizer import create_minimal_course_list
+
+
+async def http_request(reader, writer, method, path, data=None):
+    body = json.dumps(data).encode() if data is not None else b''
+    writer.write((method + ' ' + path + ' HTTP/1.1\r\nHost: localhost\r\nContent-Length: ' + str(len(body)) +
+                  '\r\n\r\n').encode() + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode()
+        if line == '\r\n':
+            break
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+    return status, json.loads(await reader.readexactly(int(headers['content-length'])))
+
+
+async def tcp_request(port, method, path, data=None):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        return await http_request(reader, writer, method, path, data)
+    finally:
+        writer.close()
+
+
+def course_dicts(courses):
+    return [batch_optimize.course_to_dict(course) for course in courses]
+
+
+class OptimizeServerTests(unittest.TestCase):
+    def run_with_server(self, test, **options):
+        async def run():
+            async with optimize_server.OptimizeService(workers=2, **options) as service:
+                server = await service.serve_tcp()
+                async with server:
+                    return await test(service, server.sockets[0].getsockname()[1])
+        return asyncio.run(run())
+
+    def testOptimize(self):
+        async def test(service, port):
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            # several requests on one connection (grades aren't rounded)
+            for courses in (create_minimal_course_list(), create_minimal_course_list(4.333), []):
+                status, data = await http_request(reader, writer, 'POST', '/optimize',
+                                                  {'courses': course_dicts(courses)})
+                self.assertEqual(status, 200)
+                expected = co.optimize(courses)
+                self.assertEqual(data['possible'], expected.possible)
+                self.assertEqual(data['max_grade'], expected.max_grade)
+                self.assertFalse(data['coalesced'])
+            writer.close()
+
+            status, data = await tcp_request(port, 'POST', '/optimize', {
+                'courses': course_dicts(create_minimal_course_list()), 'engine': 'pareto'})
+            self.assertEqual(status, 200)
+            self.assertAlmostEqual(data['max_grade'], 5.0)
+            self.assertEqual(data['assignments']['THESIS'], ["Buzzing and Fizzing: What's next?"])
+            for bad_request in ({'courses': [{'name': 'x', 'credits': 2, 'categories': ['NOPE']}]}, {},
+                                {'courses': [], 'engine': 'nope'}, {'courses': [], 'time_limit': -1}):
+                self.assertEqual((await tcp_request(port, 'POST', '/optimize', bad_request))[0], 400)
+            self.assertEqual((await tcp_request(port, 'GET', '/optimize'))[0], 405)
+            self.assertEqual((await tcp_request(port, 'GET', '/nope'))[0], 404)
+            self.assertEqual(await tcp_request(port, 'GET', '/health'), (200, {'status': 'ok', 'workers': 2}))
+
+            status, metrics = await tcp_request(port, 'GET', '/metrics')
+            self.assertEqual(status, 200)
+            # the request without courses never got to the optimizer
+            self.assertEqual(metrics['requests'], 7)
+            self.assertEqual(metrics['solves'], 4)
+            self.assertEqual(metrics['in_flight'], 0)
+            self.assertEqual(metrics['queue_depth'], 0)
+            self.assertLessEqual(metrics['latency_p50'], metrics['latency_p99'])
+        self.run_with_server(test)
+
+    def testCoalescing(self):
+        courses = benchmark.synthetic_transcript(1, 14)
+
+        async def test(service, port):
+            # the same transcript with the courses in different orders, all solved at once
+            requests = []
+            for seed in range(4):
+                shuffled = courses.copy()
+                random.Random(seed).shuffle(shuffled)
+                requests.append(tcp_request(port, 'POST', '/optimize', {'courses': course_dicts(shuffled)}))
+            requests.append(tcp_request(port, 'POST', '/optimize', {'courses': course_dicts(courses[:-1])}))
+            results = await asyncio.gather(*requests)
+            self.assertEqual([status for status, _ in results], [200] * 5)
+            self.assertEqual(len(set(json.dumps(data['assignments']) for _, data in results[:4])), 1)
+            self.assertEqual(sorted(data['coalesced'] for _, data in results[:4]), [False, True, True, True])
+            self.assertFalse(results[4][1]['coalesced'])
+            self.assertEqual(service.solves, 2)
+            self.assertEqual(service.coalesced, 3)
+            self.assertAlmostEqual(results[0][1]['max_grade'], co.optimize(courses).max_grade)
+        self.run_with_server(test, engine='dfs')
+
+    def testTimeBudget(self):
+        courses = course_dicts(benchmark.synthetic_transcript(0, 40))
+
+        async def test(service, port):
+            # the incremental engine stops at the budget with the best assignment so far
+            start = time.perf_counter()
+            status, data = await tcp_request(port, 'POST', '/optimize', {'courses': courses, 'time_limit': 0.2})
+            self.assertLess(time.perf_counter() - start, 0.2 + optimize_server.DEADLINE_GRACE)
+            self.assertEqual(status, 200)
+            self.assertTrue(data['possible'])
+            self.assertFalse(data['optimal'])
+
+            # The dfs engine can't stop early, so the requests fail instead, and their workers get replaced. There are
+            # more of them than workers, so the last one runs out of time waiting for a worker.
+            start = time.perf_counter()
+            results = await asyncio.gather(*[tcp_request(port, 'POST', '/optimize', {
+                'courses': courses[:40 - i], 'engine': 'dfs', 'time_limit': 0.1}) for i in range(3)])
+            self.assertEqual([status for status, _ in results], [504] * 3)
+            self.assertLess(time.perf_counter() - start, 0.1 + optimize_server.DEADLINE_GRACE + 0.5)
+            status, metrics = await tcp_request(port, 'GET', '/metrics')
+            self.assertEqual(metrics['timeouts'], 3)
+            self.assertEqual(metrics['restarts'], 2)
+            self.assertEqual(metrics['in_flight'], 0)
+            self.assertEqual(metrics['queue_depth'], 0)
+            # and the service still works
+            status, data = await tcp_request(port, 'POST', '/optimize', {
+                'courses': course_dicts(create_minimal_course_list()), 'engine': 'dfs'})
+            self.assertEqual(status, 200)
+            self.assertAlmostEqual(data['max_grade'], 5.0)
+        self.run_with_server(test, max_time_limit=5.)
+
+    def testTimeBudgetWhileQueued(self):
+        courses = benchmark.synthetic_transcript(0, 40)
+
+        async def test(service, port):
+            # Twice as many requests as workers. The second two wait for the first two to use up their budgets, and
+            # then only have what's left of theirs, so they still get the best assignment so far instead of a timeout.
+            start = time.perf_counter()
+            results = await asyncio.gather(*[tcp_request(port, 'POST', '/optimize', {
+                'courses': course_dicts(courses[:40 - i]), 'time_limit': 1.5}) for i in range(4)])
+            self.assertLess(time.perf_counter() - start, 1.5 + optimize_server.DEADLINE_GRACE)
+            self.assertEqual([status for status, _ in results], [200] * 4)
+            self.assertTrue(all(data['possible'] and not data['optimal'] for _, data in results))
+            self.assertEqual(service.restarts, 0)
+        self.run_with_server(test)
+
+    def testUnixSocket(self):
+        async def test():
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, 'server.sock')
+                async with optimize_server.OptimizeService(workers=1) as service:
+                    async with await service.serve_unix(path):
+                        reader, writer = await asyncio.open_unix_connection(path)
+                        status, data = await http_request(reader, writer, 'POST', '/optimize',
+                                                          {'courses': course_dicts(create_minimal_course_list())})
+                        writer.close()
+            self.assertEqual(status, 200)
+            self.assertAlmostEqual(data['max_grade'], 5.0)
+        asyncio.run(test())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import os
+import random
+import tempfile
+import unittest
+
+import course_optimizer as co
+import result_cache
+from test_course_optimizer import (assert_same_best, create_minimal_course_list, create_random_course_list,
+                                   create_relaxed_rules)
+
+
+class ResultCacheTests(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self._path = os.path.join(self._directory.name, 'cache.sqlite')
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def testHitsAndMisses(self):
+        with result_cache.ResultCache(self._path) as cache:
+            for seed in range(5):
+                courses = create_random_course_list(seed)
+                expected = co.optimize(courses)
+                first = cache.optimize(courses)
+                # same transcript in a different order, with duplicated categories
+                shuffled = courses.copy()
+                random.Random(seed).shuffle(shuffled)
+                second = cache.optimize(shuffled)
+                for result in (first, second):
+                    assert_same_best(self, result, expected)
+                if expected.possible:
+                    self.assertEqual(first.assignments, {category: sorted(assigned, key=courses.index)
+                                                         for category, assigned in second.assignments.items()})
+            self.assertEqual(cache.hits, 5)
+            self.assertEqual(cache.misses, 5)
+            self.assertAlmostEqual(cache.hit_rate, 0.5)
+            self.assertGreater(cache.mean_lookup_seconds, 0.)
+        # the cache survives reopening, and the courses come back as the caller's objects
+        courses = create_random_course_list(0)
+        with result_cache.ResultCache(self._path) as cache:
+            result = cache.optimize(courses)
+            self.assertEqual(cache.hits, 1)
+            for assigned in (result.assignments or {}).values():
+                for course in assigned:
+                    self.assertIn(course, courses)
+
+    def testUnroundedGrades(self):
+        # grades are only rounded for the key, so results are for the caller's grades, even on a hit
+        with result_cache.ResultCache(self._path) as cache:
+            for grade in (4.333, 4.334, 4.333):
+                courses = create_minimal_course_list(grade)
+                result = cache.optimize(courses, top_k=2)
+                self.assertEqual(result.max_grade, co.optimize(courses).max_grade)
+                for top_result in result.top_results:
+                    self.assertEqual(top_result.max_grade, co.compute_grade(top_result.assignments))
+            self.assertEqual(cache.hits, 2)
+
+    def testKeyDependsOnOptions(self):
+        courses = create_minimal_course_list()
+        with result_cache.ResultCache(self._path) as cache:
+            cache.optimize(courses)
+            result = cache.optimize(courses, top_k=2)
+            self.assertEqual(cache.misses, 2)
+            self.assertEqual(len(cache.optimize(courses, top_k=2).top_results), len(result.top_results))
+            self.assertEqual(cache.hits, 1)
+            # results that aren't proven optimal aren't stored
+            cache.optimize(courses, node_limit=0)
+            cache.optimize(courses, node_limit=0)
+            self.assertEqual(cache.misses, 4)
+            # nor are the ones with options that can't be part of a key
+            cache.optimize(courses, stats=co.SearchStats())
+            self.assertEqual(cache.hits + cache.misses, 5)
+
+    def testSeveralRuleSets(self):
+        rules = create_relaxed_rules()
+        courses = create_minimal_course_list()[:-1]
+        with result_cache.ResultCache(self._path) as cache:
+            self.assertFalse(cache.optimize(courses).possible)
+            self.assertTrue(cache.optimize(courses, rules=rules).possible)
+            self.assertEqual(cache.misses, 2)
+        # results of the other rule set are still there after reopening
+        with result_cache.ResultCache(self._path) as cache:
+            self.assertTrue(cache.optimize(courses, rules=rules).possible)
+            self.assertFalse(cache.optimize(courses).possible)
+            self.assertEqual(cache.hits, 2)
+
+    def testEviction(self):
+        with result_cache.ResultCache(self._path, max_bytes=700) as cache:
+            course_lists = [create_minimal_course_list(grade) for grade in (4.0, 4.5, 5.0, 5.5)]
+            for courses in course_lists:
+                cache.optimize(courses)
+            cache.optimize(course_lists[-1])
+            self.assertEqual(cache.hits, 1)
+            cache.optimize(course_lists[0])
+            self.assertEqual(cache.hits, 1)
+
+    def testRulesVersion(self):
+        version = result_cache.rules_version()
+        self.assertEqual(version, result_cache.rules_version())
+        self.assertEqual(version, result_cache.rules_version(co.RuleSet(co.DEFAULT_RULES.as_dict())))
+        self.assertNotEqual(version, result_cache.rules_version(create_relaxed_rules()))
+        self.assertEqual(result_cache.canonical_transcript(create_minimal_course_list())[0],
+                         result_cache.canonical_transcript(list(reversed(create_minimal_course_list())))[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+
+import course_optimizer as co
+from test_course_optimizer import (assert_same_best, create_minimal_course_list, create_random_course_list,
+                                   create_relaxed_rules)
+
+try:
+    import vectorized_optimizer
+except ImportError:
+    vectorized_optimizer = None
+
+
+@unittest.skipIf(vectorized_optimizer is None, 'numpy is not installed')
+class VectorizedOptimizerTests(unittest.TestCase):
+    def testTrivialSolutions(self):
+        result = co.optimize(create_minimal_course_list(4.0), engine='vectorized')
+        self.assertTrue(result.possible)
+        self.assertAlmostEqual(result.max_grade, 4.0)
+        self.assertFalse(co.optimize([], engine='vectorized').possible)
+
+    def testChunkSizeDoesNotMatter(self):
+        for seed in range(10):
+            courses = create_random_course_list(seed)
+            expected = co.optimize(courses)
+            for chunk_size in [1, 7, 1000]:
+                result = co.optimize(courses, engine='vectorized', chunk_size=chunk_size)
+                assert_same_best(self, result, expected)
+                if expected.possible:
+                    self.assertAlmostEqual(result.worst_grade, co.optimize(courses, engine='vectorized').worst_grade)
+
+    def testLabAndPassFail(self):
+        courses = create_minimal_course_list(4.0) + [
+            co.Course("Lab 1", 6.0, 10, co.Category.ELECTIVE_CS, co.Category.ELECTIVE).lab(True),
+            co.Course("Lab 2", 6.0, 10, co.Category.ELECTIVE_CS, co.Category.ELECTIVE).lab(True),
+            co.Course("Pass/fail", None, 10, co.Category.ELECTIVE_CS, co.Category.ELECTIVE).passfail(True),
+        ]
+        result = co.optimize(courses, engine='vectorized')
+        self.assertAlmostEqual(result.max_grade, co.optimize(courses, engine='dfs').max_grade)
+        labs = [course for assigned in result.assignments.values() for course in assigned if course._is_lab]
+        self.assertEqual(len(labs), 1)
+
+    def testOtherRules(self):
+        rules = create_relaxed_rules()
+        for seed in range(10):
+            courses = create_random_course_list(seed)
+            result = co.optimize(courses, engine='vectorized', rules=rules)
+            assert_same_best(self, result, co.optimize(courses, rules=rules), rules)
+
+    def testTooManyAssignments(self):
+        courses = [co.Course(str(i), 5.0, 6, co.Category.CORE_FOCUS, co.Category.ELECTIVE_CS, co.Category.ELECTIVE)
+                   for i in range(40)]
+        with self.assertRaises(ValueError):
+            co.optimize(courses, engine='vectorized')
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
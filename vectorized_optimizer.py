@@ -0,0 +1,94 @@
+import numpy as np
+
+import course_optimizer as co
+
+# Assignments evaluated per block. Each one needs a row of the one-hot option matrix, so this bounds the memory use.
+DEFAULT_CHUNK_SIZE = 1 << 16
+# Beyond this, brute force takes too long no matter how it's vectorized; use the incremental or milp engines instead
+MAX_ASSIGNMENTS = 1 << 34
+
+
+def _option_row(course, category, rules):
+    # the credit counters, graded credits and grade points per group, and lab usage
+    num_counters = rules.num_counters
+    num_groups = len(rules.grade_groups)
+    row = np.zeros(num_counters + 2 * num_groups + 1)
+    if category is None:
+        return row
+    row[:num_counters] = np.multiply(rules.incidence[category], course.credits)
+    group = rules.category_groups[category]
+    if group is not None and not course._is_passfail:
+        row[num_counters + group] = course.credits
+        row[num_counters + num_groups + group] = course.credits * course.grade
+    row[-1] = 1. if course._is_lab else 0.
+    return row
+
+
+def optimize_vectorized(courses, chunk_size=DEFAULT_CHUNK_SIZE):
+    # Brute force over every assignment, a block at a time. Each course's options (including leaving it out) are a
+    # digit of a mixed-radix number, so the assignments are just the numbers 0 .. num_assignments - 1. A block of them
+    # gets one-hot encoded, and one matrix product with the option table gives all the credit counts, group sums and
+    # lab counts at once.
+    courses = co.compile_courses(courses)
+    rules = courses.rules
+    num_counters = rules.num_counters
+    num_groups = len(rules.grade_groups)
+    credits_columns = slice(num_counters, num_counters + num_groups)
+    points_columns = slice(num_counters + num_groups, num_counters + 2 * num_groups)
+    options = [course.undominated for course in courses]
+    radices = [len(course_options) for course_options in options]
+    num_assignments = 1
+    for radix in radices:
+        num_assignments *= radix
+    if num_assignments > MAX_ASSIGNMENTS:
+        raise ValueError('Too many possible assignments (' + str(num_assignments) + ') for the vectorized engine')
+
+    offsets = np.cumsum([0] + radices[:-1])
+    table = np.array([_option_row(course, category, rules) for course, course_options in zip(courses, options)
+                      for category in course_options]).reshape(sum(radices), num_counters + 2 * num_groups + 1)
+    min_counts = np.array(rules.min_counts, dtype=float)
+    # strict counters (like core focus) need more credits than their minimum
+    strict = np.array(rules.strict, dtype=bool)
+    weights = np.array(rules.weights) / rules.weight_total
+
+    best_grade = None
+    best_index = None
+    worst_grade = None
+    for start in range(0, num_assignments, chunk_size):
+        indices = np.arange(start, min(start + chunk_size, num_assignments), dtype=np.int64)
+        # the first course is the most significant digit
+        one_hot = np.zeros((len(indices), table.shape[0]))
+        remaining = indices.copy()
+        for course_index in reversed(range(len(courses))):
+            remaining, digits = np.divmod(remaining, radices[course_index])
+            one_hot[np.arange(len(indices)), offsets[course_index] + digits] = 1.
+        sums = one_hot @ table
+
+        counts = sums[:, :num_counters]
+        feasible = np.all(np.where(strict, counts > min_counts, counts >= min_counts), axis=1)
+        # can't assign more than one lab
+        feasible &= sums[:, -1] <= 1.
+        if not feasible.any():
+            continue
+        credits = sums[feasible, credits_columns]
+        points = sums[feasible, points_columns]
+        averages = np.divide(points, credits, out=np.zeros_like(points), where=credits != 0.)
+        grades = averages @ weights
+
+        chunk_best = int(np.argmax(grades))
+        if best_grade is None or grades[chunk_best] > best_grade:
+            best_grade = float(grades[chunk_best])
+            best_index = int(indices[feasible][chunk_best])
+        if worst_grade is None or grades.min() < worst_grade:
+            worst_grade = float(grades.min())
+
+    if best_grade is None:
+        return co.OptimizationResult(False, None, None, None)
+    assignments = {category: [] for category in co.Category}
+    for course_index in reversed(range(len(courses))):
+        best_index, digit = divmod(best_index, radices[course_index])
+        category = options[course_index][digit]
+        if category is not None:
+            assignments[category].insert(0, courses[course_index].course)
+    # report the grade the same way the other engines compute it
+    return co.OptimizationResult(True, rules.grade(assignments), assignments, worst_grade)